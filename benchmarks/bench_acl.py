@@ -0,0 +1,74 @@
+"""Compare pyramid's ACLHelper against CompiledACLHelper.
+
+Uses an ACL with a few hundred entries and a user that is a member of a few
+dozen groups, the permission being checked is only granted near the end of
+the ACL so that the linear walk has to go through most of it.
+
+Run with ``python benchmarks/bench_acl.py``.
+"""
+import argparse
+import sys
+
+from common import add_arguments, finish, measure, print_result
+from pyramid.authorization import ACLHelper, Allow, Authenticated, Deny, Everyone
+
+from pyramid_authsanity.acl import CompiledACLHelper
+
+
+class Resource(object):
+    def __init__(self, acl, parent=None):
+        self.__acl__ = acl
+        self.__parent__ = parent
+
+
+def make_tree(entries):
+    acl = []
+
+    for i in range(entries):
+        action = Deny if i % 7 == 0 else Allow
+        acl.append((action, "group:%d" % (i,), ("view", "edit")))
+
+    acl.append((Allow, "group:member-30", "view"))
+    root = Resource([(Allow, Authenticated, "read")])
+    return Resource(acl, parent=root)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    parser.add_argument("-e", "--entries", type=int, default=300)
+    parser.add_argument("-g", "--groups", type=int, default=40)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    context = make_tree(args.entries)
+    groups = ["group:member-%d" % (i,) for i in range(args.groups)]
+    principals = [Everyone, Authenticated, "bob"] + groups
+    results = []
+
+    for name, helper, user in (
+        ("acl.ACLHelper.list", ACLHelper(), principals),
+        ("acl.ACLHelper.frozenset", ACLHelper(), frozenset(principals)),
+        ("acl.CompiledACLHelper", CompiledACLHelper(), frozenset(principals)),
+        ("acl.CompiledACLHelper.tuple", CompiledACLHelper(), frozenset(principals)),
+    ):
+        context.__acl__ = (
+            tuple(context.__acl__) if name.endswith(".tuple") else list(context.__acl__)
+        )
+
+        for permission in ("view", "read", "delete"):
+
+            def check(_):
+                helper.permits(context, user, permission)
+
+            result = measure(
+                "%s.%s" % (name, permission), check, lambda: None, args.number
+            )
+            print_result(result)
+            results.append(result)
+
+    return finish(args, results)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Compare the JSON and compact encodings of the cookie and header sources.
+
+Measures serializing and signing a value (what ``remember()`` does) and
+verifying and deserializing it (what every authenticated request does), for
+both the plain ``[principal, ticket]`` value and the value stored in
+stateless mode, and prints the size of the resulting token. ``get_value`` is
+also measured with the decoded token cache enabled, a repeated token is then
+a cache hit.
+
+Run with ``python benchmarks/bench_encoding.py``.
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+from common import add_arguments, finish, measure, print_result
+
+from pyramid_authsanity import sources
+
+SECRET = "seekrit" * 10
+
+
+class DummyRequest(object):
+    domain = "example.net"
+
+    def __init__(self, authorization=None):
+        self.cookies = {}
+        self.authorization = authorization
+        self.session = {}
+
+
+def make_values():
+    ticket = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
+    now = int(time.time())
+
+    return (
+        ("plain", ["user@example.net", ticket]),
+        (
+            "stateless",
+            [
+                "user@example.net",
+                ticket,
+                now,
+                now + 300,
+                ["group:editors", "group:staff"],
+            ],
+        ),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = []
+
+    for (label, value) in make_values():
+        for encoding in ("json", "compact"):
+            factory = sources.HeaderAuthSourceInitializer(SECRET, encoding=encoding)
+            serializer = factory(None, DummyRequest()).serializer
+            token = serializer.dumps(value).decode("ascii")
+            name = "encoding.%s.%s" % (label, encoding)
+
+            print("%-44s %5d bytes" % (name, len(token)))
+
+            result = measure(
+                name + ".dumps", serializer.dumps, lambda: value, args.number
+            )
+            print_result(result)
+            results.append(result)
+
+            request = DummyRequest(authorization=("Bearer", token))
+
+            def get_value(_):
+                factory(None, request).get_value()
+
+            result = measure(name + ".get_value", get_value, lambda: None, args.number)
+            print_result(result)
+            results.append(result)
+
+            cached = sources.HeaderAuthSourceInitializer(
+                SECRET, encoding=encoding, cache_size=1000
+            )
+
+            def get_value_cached(_):
+                cached(None, request).get_value()
+
+            result = measure(
+                name + ".get_value.cached", get_value_cached, lambda: None, args.number
+            )
+            print_result(result)
+            results.append(result)
+
+    return finish(args, results)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""Microbenchmarks for the AuthServicePolicy hot paths.
+
+Measures ``authenticated_userid``, ``effective_principals``, a series of
+``request.has_permission`` checks, ``remember`` and ``forget`` against the
+cookie, session and header sources, using an in-process authentication
+service so that only pyramid_authsanity is being measured.
+
+The permission checks are also measured with the services looked up on every
+call into the policy, as before they were kept on the request, and the
+speedup is printed.
+
+Run with ``python benchmarks/bench_policy.py``, use ``--output`` to store the
+results as JSON and ``--compare`` to compare against a previous run.
+"""
+import argparse
+import sys
+import warnings
+
+from common import add_arguments, finish, measure, print_result
+from pyramid.authorization import (
+    ALL_PERMISSIONS,
+    ACLAuthorizationPolicy,
+    Allow,
+    Authenticated,
+)
+from pyramid.config import Configurator
+from pyramid.interfaces import IAuthenticationPolicy
+from pyramid.request import Request, apply_request_extensions
+from pyramid.session import SignedCookieSessionFactory
+from zope.interface import implementer
+
+from pyramid_authsanity.interfaces import IAuthService, IAuthSourceService
+
+SOURCES = ("cookie", "session", "header")
+PERMISSIONS = ("view", "edit", "delete", "admin", "comment", "share", "audit")
+
+
+class Context(object):
+    __acl__ = [
+        (Allow, Authenticated, ("view", "comment")),
+        (Allow, "group:staff", ("edit", "share")),
+        (Allow, "group:admin", ALL_PERMISSIONS),
+    ]
+
+
+context = Context()
+
+
+class MemoryStore(object):
+    """The storage backing the fake authentication service."""
+
+    def __init__(self, groups):
+        self.tickets = {}
+        self.groups = groups
+
+
+def fake_auth_service(store):
+    @implementer(IAuthService)
+    class FakeAuthService(object):
+        def __init__(self, context, request):
+            self._userid = None
+            self._verified = False
+
+        def userid(self):
+            if not self._verified:
+                raise ValueError("No ticket verified")
+
+            return self._userid
+
+        def groups(self):
+            return store.groups.get(self._userid, [])
+
+        def verify_ticket(self, principal, ticket):
+            self._verified = True
+
+            if store.tickets.get(ticket) == principal:
+                self._userid = principal
+
+        def add_ticket(self, principal, ticket):
+            store.tickets[ticket] = principal
+
+        def remove_ticket(self, ticket):
+            return store.tickets.pop(ticket, None) is not None
+
+    return FakeAuthService
+
+
+def make_app(source, store):
+    settings = {
+        "authsanity.source": source,
+        "authsanity.secret": "seekrit" * 10,
+    }
+    config = Configurator(settings=settings)
+
+    with warnings.catch_warnings():
+        # Authentication/authorization policies are deprecated in Pyramid 2.0
+        warnings.simplefilter("ignore", DeprecationWarning)
+        config.set_authorization_policy(ACLAuthorizationPolicy())
+
+    if source == "session":
+        config.set_session_factory(SignedCookieSessionFactory("sessionseekrit"))
+
+    config.include("pyramid_authsanity")
+    config.register_service_factory(fake_auth_service(store), iface=IAuthService)
+    config.commit()
+
+    return config.registry
+
+
+def make_request(registry, headers=None, cookies=None):
+    request = Request.blank("/", headers=headers)
+    request.registry = registry
+
+    if cookies:
+        for name, value in cookies.items():
+            request.cookies[name] = value
+
+    apply_request_extensions(request)
+    return request
+
+
+def login(registry, policy, source):
+    """Log in a user, and return the headers/cookies a client would send back
+    on a subsequent request."""
+    request = make_request(registry)
+    headers = policy.remember(request, "bob")
+
+    if source == "header":
+        return {"headers": dict(headers)}
+
+    if source == "cookie":
+        (name, value) = headers[0][1].split(";")[0].split("=", 1)
+        return {"cookies": {name: value}}
+
+    # Session source, persist the session through its cookie
+    response = request.response
+    request._process_response_callbacks(response)
+    cookie = response.headers["Set-Cookie"].split(";")[0]
+    (name, value) = cookie.split("=", 1)
+    return {"cookies": {name: value}}
+
+
+def find_services_uncached(request):
+    """How the policy found its services before they were kept on the
+    request."""
+    return (
+        request.find_service(IAuthSourceService),
+        request.find_service(IAuthService),
+    )
+
+
+def run(number):
+    results = []
+
+    for source in SOURCES:
+        store = MemoryStore({"bob": ["group:staff", "group:admin"]})
+        registry = make_app(source, store)
+        policy = registry.getUtility(IAuthenticationPolicy)
+        credentials = login(registry, policy, source)
+
+        def anonymous():
+            return make_request(registry)
+
+        def authenticated():
+            return make_request(registry, **credentials)
+
+        cases = (
+            ("authenticated_userid", "anonymous", anonymous),
+            ("authenticated_userid", "authenticated", authenticated),
+            ("effective_principals", "anonymous", anonymous),
+            ("effective_principals", "authenticated", authenticated),
+            ("permits", "anonymous", anonymous),
+            ("permits", "authenticated", authenticated),
+            ("remember", "anonymous", anonymous),
+            ("forget", "authenticated", authenticated),
+        )
+
+        for operation, kind, setup in cases:
+            if operation == "remember":
+
+                def func(request):
+                    policy.remember(request, "bob")
+
+            elif operation == "permits":
+
+                def func(request):
+                    # A view checking several permissions on the request, the
+                    # policy is asked for the identity every time
+                    for permission in PERMISSIONS:
+                        request.has_permission(permission, context)
+
+            else:
+                func = getattr(policy, operation)
+
+            name = "%s.%s.%s" % (source, operation, kind)
+            result = measure(name, func, setup, number)
+            print_result(result)
+            results.append(result)
+
+            if operation == "permits":
+                # Same checks, with the services looked up on every call
+                policy._find_services = find_services_uncached
+
+                try:
+                    before = measure(name + ".before", func, setup, number)
+                finally:
+                    del policy._find_services
+
+                print_result(before)
+                results.append(before)
+                print(
+                    "%-44s %11.2fx"
+                    % ("speedup", result["ops_per_sec"] / before["ops_per_sec"])
+                )
+
+            if operation == "forget":
+                # Forget removes the ticket, log in again for the next case
+                credentials.update(login(registry, policy, source))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=5000)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = run(args.number)
+    return finish(args, results)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
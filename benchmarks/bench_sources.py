@@ -0,0 +1,89 @@
+"""Benchmark the per-request cost of the authentication sources.
+
+Run with ``python benchmarks/bench_sources.py``. Each benchmark simulates one
+request: the source is created for the request and the value is read from it,
+which is what the authentication policy does on every request.
+"""
+import argparse
+import timeit
+
+from webob.cookies import SignedCookieProfile
+
+from pyramid_authsanity import sources
+
+SECRET = "seekrit" * 10
+
+
+class DummyRequest(object):
+    domain = "example.net"
+
+    def __init__(self, cookies=None, authorization=None):
+        self.cookies = cookies or {}
+        self.authorization = authorization
+        self.session = {}
+
+
+def legacy_cookie_source(secret, cookie_name="auth", hashalg="sha512"):
+    """The cookie source as it was before the signer was shared, this builds a
+    new SignedCookieProfile for every request."""
+
+    class LegacyCookieAuthSource(object):
+        def __init__(self, context, request):
+            self.cookie = SignedCookieProfile(
+                secret, "authsanity", cookie_name, hashalg=hashalg
+            ).bind(request)
+
+        def get_value(self):
+            val = self.cookie.get_value()
+
+            if val is None:
+                return [None, None]
+
+            return val
+
+    return LegacyCookieAuthSource
+
+
+def make_cookie(factory):
+    source = factory(None, DummyRequest())
+    headers = source.cookie.get_headers(["user1", "ticket1"])
+    return headers[0][1].split(";")[0].split("=", 1)[1]
+
+
+def bench(name, factory, request, number):
+    def run():
+        factory(None, request).get_value()
+
+    elapsed = min(timeit.repeat(run, number=number, repeat=5))
+    rps = number / elapsed
+    print("%-32s %12.0f req/s %10.2f us/req" % (name, rps, 1e6 / rps))
+    return rps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    current = sources.CookieAuthSourceInitializer(SECRET)
+    legacy = legacy_cookie_source(SECRET)
+    cookie = make_cookie(current)
+
+    for label, request in (
+        ("anonymous", DummyRequest()),
+        ("authenticated", DummyRequest(cookies={"auth": cookie})),
+    ):
+        before = bench("cookie %s (before)" % label, legacy, request, args.number)
+        after = bench("cookie %s (after)" % label, current, request, args.number)
+        print("%-32s %12.2fx" % ("speedup", after / before))
+
+    for hashalg in ("sha512", "sha256", "blake2b"):
+        header = sources.HeaderAuthSourceInitializer(SECRET, hashalg=hashalg)
+        headers = header(None, DummyRequest()).headers_remember(["user1", "t1"])
+        (_, token) = headers[0][1].split(" ")
+        request = DummyRequest(authorization=("Bearer", token))
+        bench("header %s" % hashalg, header, request, args.number)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,316 @@
+"""Multi-threaded end to end WSGI throughput for includeme configured apps.
+
+For each ``authsanity.source`` a real Pyramid application is built through
+``config.include("pyramid_authsanity")`` and driven by a pool of threads, in
+the same way a threaded WSGI server (waitress, gunicorn with gthread) would
+call it. Every simulated client keeps its own cookies/Authorization header and
+performs a mix of anonymous, authenticated, login and logout requests.
+
+Run with ``python benchmarks/bench_wsgi.py``, use ``--output`` to store the
+results as JSON and ``--compare`` to compare against a previous run.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import random
+import sys
+import threading
+import time
+import warnings
+
+from common import add_arguments, finish, print_result, summarize
+from pyramid.authorization import ACLAuthorizationPolicy, Allow, Authenticated
+from pyramid.config import Configurator
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.security import forget, remember
+from pyramid.session import SignedCookieSessionFactory
+from webob import Request
+from zope.interface import implementer
+
+from pyramid_authsanity.interfaces import IAuthService
+
+SOURCES = ("cookie", "session", "header")
+
+# Relative weights of the kinds of requests made by the clients
+DEFAULT_MIX = "anonymous=50,authenticated=40,login=5,logout=5"
+
+
+class Root(object):
+    __acl__ = [
+        (Allow, Authenticated, "view"),
+        (Allow, "group:staff", "edit"),
+    ]
+
+    def __init__(self, request):
+        pass
+
+
+class TicketStore(object):
+    """A thread safe in memory ticket store for the fake auth service."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tickets = {}
+        self.groups = {"bob": ["group:staff"]}
+
+    def verify(self, principal, ticket):
+        return self.tickets.get(ticket) == principal
+
+    def add(self, principal, ticket):
+        with self.lock:
+            self.tickets[ticket] = principal
+
+    def remove(self, ticket):
+        with self.lock:
+            return self.tickets.pop(ticket, None) is not None
+
+
+def fake_auth_service(store):
+    @implementer(IAuthService)
+    class FakeAuthService(object):
+        def __init__(self, context, request):
+            self._userid = None
+            self._verified = False
+
+        def userid(self):
+            if not self._verified:
+                raise ValueError("No ticket verified")
+
+            return self._userid
+
+        def groups(self):
+            return store.groups.get(self._userid, [])
+
+        def verify_ticket(self, principal, ticket):
+            self._verified = True
+
+            if store.verify(principal, ticket):
+                self._userid = principal
+
+        def add_ticket(self, principal, ticket):
+            store.add(principal, ticket)
+
+        def remove_ticket(self, ticket):
+            return store.remove(ticket)
+
+    return FakeAuthService
+
+
+def public_view(request):
+    request.response.text = "hello %s" % (request.authenticated_userid,)
+    return request.response
+
+
+def private_view(request):
+    # A handful of permission checks, like a template rendering a menu
+    allowed = [request.has_permission(p) for p in ("view", "edit", "delete")]
+
+    if not allowed[0]:
+        raise HTTPForbidden()
+
+    request.response.text = "private %r" % (allowed,)
+    return request.response
+
+
+def login_view(request):
+    request.response.headerlist.extend(remember(request, "bob"))
+    return request.response
+
+
+def logout_view(request):
+    request.response.headerlist.extend(forget(request))
+    return request.response
+
+
+def make_app(source, security_policy=False):
+    settings = {
+        "authsanity.source": source,
+        "authsanity.secret": "seekrit" * 10,
+        "authsanity.security_policy": security_policy,
+    }
+    config = Configurator(settings=settings, root_factory=Root)
+
+    if not security_policy:
+        with warnings.catch_warnings():
+            # Authentication/authorization policies are deprecated in Pyramid 2.0
+            warnings.simplefilter("ignore", DeprecationWarning)
+            config.set_authorization_policy(ACLAuthorizationPolicy())
+
+    if source == "session":
+        config.set_session_factory(SignedCookieSessionFactory("sessionseekrit"))
+
+    config.include("pyramid_authsanity")
+    config.register_service_factory(
+        fake_auth_service(TicketStore()), iface=IAuthService
+    )
+
+    for name, view in (
+        ("public", public_view),
+        ("private", private_view),
+        ("login", login_view),
+        ("logout", logout_view),
+    ):
+        config.add_route(name, "/" + name)
+        config.add_view(view, route_name=name)
+
+    return config.make_wsgi_app()
+
+
+class Client(object):
+    """A client that remembers what the server told it to send back."""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies = {}
+        self.authorization = None
+
+    def request(self, path):
+        request = Request.blank(path)
+
+        if self.cookies:
+            request.headers["Cookie"] = "; ".join(
+                "%s=%s" % item for item in self.cookies.items()
+            )
+
+        if self.authorization:
+            request.headers["Authorization"] = self.authorization
+
+        response = request.get_response(self.app)
+
+        for name, value in response.headerlist:
+            if name == "Set-Cookie":
+                (cookie_name, cookie_value) = value.split(";")[0].split("=", 1)
+
+                if cookie_value:
+                    self.cookies[cookie_name] = cookie_value
+                else:
+                    self.cookies.pop(cookie_name, None)
+            elif name == "Authorization":
+                self.authorization = value
+
+        if path == "/logout":
+            self.authorization = None
+
+        return response
+
+
+def parse_mix(mix):
+    kinds = []
+    weights = []
+
+    for part in mix.split(","):
+        (kind, weight) = part.split("=")
+        kinds.append(kind.strip())
+        weights.append(int(weight))
+
+    return kinds, weights
+
+
+def run_source(source, threads, number, mix, seed, security_policy=False):
+    app = make_app(source, security_policy)
+    kinds, weights = parse_mix(mix)
+    rnd = random.Random(seed)
+    plan = rnd.choices(kinds, weights, k=number)
+
+    # One logged in client per thread, and one that never logs in
+    local = threading.local()
+    anonymous = Client(app)
+    timings = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    timings_lock = threading.Lock()
+
+    def client():
+        c = getattr(local, "client", None)
+
+        if c is None:
+            c = local.client = Client(app)
+            c.request("/login")
+
+        return c
+
+    def work(kind):
+        if kind == "anonymous":
+            c, path = anonymous, "/public"
+        elif kind == "authenticated":
+            c, path = client(), "/private"
+        elif kind == "login":
+            c, path = client(), "/login"
+        else:
+            c, path = client(), "/logout"
+
+        start = time.perf_counter_ns()
+        response = c.request(path)
+        elapsed = time.perf_counter_ns() - start
+
+        if response.status_code != 200:
+            with timings_lock:
+                errors[kind] += 1
+
+        if kind == "logout":
+            # Log back in so the next authenticated request has a user
+            c.request("/login")
+
+        with timings_lock:
+            timings[kind].append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in pool.map(work, plan):
+            pass
+    wall = time.perf_counter() - start
+
+    results = []
+    every = []
+
+    for kind in kinds:
+        if timings[kind]:
+            result = summarize("%s.%s" % (source, kind), timings[kind])
+            # Throughput is measured for the whole pool, not per thread
+            result["ops_per_sec"] = len(timings[kind]) / wall
+            result["errors"] = errors[kind]
+            results.append(result)
+            every.extend(timings[kind])
+
+    total = summarize("%s.all" % (source,), every)
+    total["ops_per_sec"] = len(every) / wall
+    total["errors"] = sum(errors.values())
+    total["threads"] = threads
+    results.insert(0, total)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=5000)
+    parser.add_argument("-j", "--threads", type=int, default=8)
+    parser.add_argument("-m", "--mix", default=DEFAULT_MIX)
+    parser.add_argument("-s", "--source", action="append", choices=SOURCES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-p",
+        "--security-policy",
+        action="store_true",
+        help="use AuthServiceSecurityPolicy instead of the authentication policy",
+    )
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = []
+
+    for source in args.source or SOURCES:
+        for result in run_source(
+            source,
+            args.threads,
+            args.number,
+            args.mix,
+            args.seed,
+            args.security_policy,
+        ):
+            print_result(result)
+            results.append(result)
+
+    return finish(args, results)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Helpers shared by the benchmark scripts.
+
+Results are plain dictionaries so that they may be written out as JSON and
+compared against the results of an earlier run to catch regressions.
+"""
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+
+def percentile(samples, pct):
+    """Returns the ``pct`` percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+
+    index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+def summarize(name, timings_ns, peak_bytes=None):
+    """Turn a list of per-call timings (in nanoseconds) into a result."""
+    timings = sorted(timings_ns)
+    total = sum(timings) or 1
+
+    result = {
+        "name": name,
+        "calls": len(timings),
+        "ops_per_sec": len(timings) * 1e9 / total,
+        "mean_us": total / len(timings) / 1e3,
+        "p50_us": percentile(timings, 50) / 1e3,
+        "p95_us": percentile(timings, 95) / 1e3,
+        "p99_us": percentile(timings, 99) / 1e3,
+    }
+
+    if peak_bytes is not None:
+        result["peak_bytes_per_call"] = peak_bytes
+
+    return result
+
+
+def measure(name, func, setup, number, alloc_samples=200):
+    """Measure ``func(arg)`` where ``arg`` is created fresh by ``setup()`` for
+    every call. Setup is not included in the timings.
+
+    Allocations are measured separately (tracing slows everything down) as
+    the average peak number of bytes traced during a single call.
+    """
+    args = [setup() for _ in range(number)]
+    timings = []
+    clock = time.perf_counter_ns
+
+    for arg in args:
+        start = clock()
+        func(arg)
+        timings.append(clock() - start)
+
+    args = [setup() for _ in range(alloc_samples)]
+    peak = 0
+
+    tracemalloc.start()
+    try:
+        for arg in args:
+            tracemalloc.clear_traces()
+            func(arg)
+            peak += tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return summarize(name, timings, peak // max(alloc_samples, 1))
+
+
+def print_result(result):
+    line = "%-44s %11.0f ops/s  p50 %8.2fus  p95 %8.2fus  p99 %8.2fus" % (
+        result["name"],
+        result["ops_per_sec"],
+        result["p50_us"],
+        result["p95_us"],
+        result["p99_us"],
+    )
+
+    if "peak_bytes_per_call" in result:
+        line += "  %7d B/call" % (result["peak_bytes_per_call"],)
+
+    if result.get("errors"):
+        line += "  %d errors" % (result["errors"],)
+
+    print(line)
+
+
+def write_results(path, results):
+    data = {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def compare_results(path, results, threshold):
+    """Compare ``results`` against those stored in ``path``. Returns a list of
+    benchmark names whose throughput dropped by more than ``threshold``
+    percent."""
+    with open(path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = []
+
+    for result in results:
+        old = baseline.get(result["name"])
+
+        if old is None:
+            continue
+
+        change = (result["ops_per_sec"] - old["ops_per_sec"]) / old["ops_per_sec"]
+        print("%-44s %+8.1f%%" % (result["name"], change * 100))
+
+        if change * 100 < -threshold:
+            regressions.append(result["name"])
+
+    return regressions
+
+
+def add_arguments(parser):
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument(
+        "-c", "--compare", help="compare against results stored in this JSON file"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent drop in ops/s that is reported as a regression",
+    )
+
+
+def finish(args, results):
+    """Write and/or compare results as requested on the command line, returns
+    the process exit code."""
+    if args.output:
+        write_results(args.output, results)
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+
+        if regressions:
+            print("Regressions: %s" % (", ".join(regressions),))
+            return 1
+
+    return 0
@@ -1,57 +1,127 @@
+from pyramid.config import PHASE3_CONFIG
 from pyramid.settings import asbool, aslist
 
-from .interfaces import IAuthSourceService
-from .policy import AuthServicePolicy
+from .cache import GroupsCache
+from .interfaces import IAuthService, IAuthSourceService
+from .policy import AuthServicePolicy, AuthServiceSecurityPolicy
+from .resp import RedisAuthServiceInitializer
+from .services import CachingAuthServiceInitializer, MemoryAuthServiceInitializer
+from .shm import SharedMemoryCache
 from .sources import (
+    CompositeAuthSourceInitializer,
     CookieAuthSourceInitializer,
     HeaderAuthSourceInitializer,
     SessionAuthSourceInitializer,
 )
-from .util import int_or_none, kw_from_settings
+from .sql import SQLAuthServiceInitializer
+from .util import float_or_none, int_or_none, keyring_from_settings, kw_from_settings
 
 default_settings = (
     ("source", str, ""),
+    ("remember_source", str, ""),
+    ("service", str, ""),
     ("debug", asbool, False),
+    ("security_policy", asbool, False),
+    ("keyring", keyring_from_settings, ""),
+    ("stateless_ttl", int_or_none, None),
+    ("anonymous_fast_path", asbool, True),
+    ("timeout", int_or_none, None),
+    ("reissue_time", int_or_none, None),
     ("cookie.cookie_name", str, "auth"),
     ("cookie.max_age", int_or_none, None),
     ("cookie.httponly", asbool, True),
     ("cookie.path", str, "/"),
     ("cookie.domains", aslist, []),
     ("cookie.debug", asbool, False),
+    ("cookie.encoding", str, "json"),
+    ("cookie.cache_size", int, 0),
     ("session.value_key", str, "sanity."),
+    ("header.hashalg", str, "sha512"),
+    ("header.encoding", str, "json"),
+    ("header.cache_size", int, 0),
+    ("memory.max_size", int, 10000),
+    ("memory.ttl", int_or_none, None),
+    ("memory.shards", int, 16),
+    ("sql.pool_size", int, 5),
+    ("sql.ttl", int_or_none, None),
+    ("redis.host", str, "localhost"),
+    ("redis.port", int, 6379),
+    ("redis.db", int, 0),
+    ("redis.timeout", float_or_none, None),
+    ("redis.pool_size", int, 5),
+    ("redis.ttl", int_or_none, None),
+    ("redis.prefix", str, "authsanity:"),
+    ("verify_cache", asbool, False),
+    ("verify_cache.max_size", int, 10000),
+    ("verify_cache.ttl", int_or_none, 30),
+    ("verify_cache.negative_ttl", int_or_none, 30),
+    ("verify_cache.shared", asbool, False),
+    ("groups_cache", asbool, False),
+    ("groups_cache.max_size", int, 10000),
+    ("groups_cache.ttl", int_or_none, 60),
 )
 
 
-def init_cookie_source(config, settings):
-    if "authsanity.secret" not in settings:
-        raise RuntimeError("authsanity.secret is required for cookie based storage")
+def cookie_source_factory(config, settings):
+    if "authsanity.secret" not in settings and not settings["authsanity.keyring"]:
+        raise RuntimeError(
+            "authsanity.secret or authsanity.keyring is required for cookie "
+            "based storage"
+        )
 
     kw = kw_from_settings(settings, "authsanity.cookie.")
 
-    config.register_service_factory(
-        CookieAuthSourceInitializer(settings["authsanity.secret"], **kw),
-        iface=IAuthSourceService,
+    return CookieAuthSourceInitializer(
+        settings.get("authsanity.secret"),
+        keyring=settings["authsanity.keyring"],
+        **kw,
     )
 
 
-def init_session_source(config, settings):
+def session_source_factory(config, settings):
     kw = kw_from_settings(settings, "authsanity.session.")
 
-    config.register_service_factory(
-        SessionAuthSourceInitializer(**kw), iface=IAuthSourceService
-    )
+    return SessionAuthSourceInitializer(**kw)
 
 
-def init_authorization_header_source(config, settings):
-    if "authsanity.secret" not in settings:
+def authorization_header_source_factory(config, settings):
+    if "authsanity.secret" not in settings and not settings["authsanity.keyring"]:
         raise RuntimeError(
-            "authsanity.secret is required for Authorization header source"
+            "authsanity.secret or authsanity.keyring is required for "
+            "Authorization header source"
         )
 
     kw = kw_from_settings(settings, "authsanity.header.")
 
+    return HeaderAuthSourceInitializer(
+        settings.get("authsanity.secret"),
+        keyring=settings["authsanity.keyring"],
+        **kw,
+    )
+
+
+default_source_factories = {
+    "cookie": cookie_source_factory,
+    "session": session_source_factory,
+    "header": authorization_header_source_factory,
+}
+
+
+def init_cookie_source(config, settings):
+    config.register_service_factory(
+        cookie_source_factory(config, settings), iface=IAuthSourceService
+    )
+
+
+def init_session_source(config, settings):
+    config.register_service_factory(
+        session_source_factory(config, settings), iface=IAuthSourceService
+    )
+
+
+def init_authorization_header_source(config, settings):
     config.register_service_factory(
-        HeaderAuthSourceInitializer(settings["authsanity.secret"], **kw),
+        authorization_header_source_factory(config, settings),
         iface=IAuthSourceService,
     )
 
@@ -63,6 +133,75 @@ default_sources = {
 }
 
 
+def init_composite_source(config, settings, names):
+    for name in names:
+        if name not in default_source_factories:
+            raise RuntimeError("Unknown authsanity.source: %r" % (name,))
+
+    remember = settings["authsanity.remember_source"] or names[0]
+
+    if remember not in names:
+        raise RuntimeError(
+            "authsanity.remember_source must be one of authsanity.source"
+        )
+
+    config.register_service_factory(
+        CompositeAuthSourceInitializer(
+            [default_source_factories[name](config, settings) for name in names],
+            remember_source=names.index(remember),
+        ),
+        iface=IAuthSourceService,
+    )
+
+
+def register_auth_service(config, settings, factory):
+    if settings["authsanity.verify_cache"]:
+        kw = kw_from_settings(settings, "authsanity.verify_cache.")
+        shared = kw.pop("shared")
+        path = kw.pop("shared_path", None)
+
+        if shared:
+            kw["cache"] = SharedMemoryCache(
+                max_size=kw["max_size"], ttl=kw["ttl"], path=path
+            )
+
+        factory = CachingAuthServiceInitializer(factory, **kw)
+
+    config.register_service_factory(factory, iface=IAuthService)
+
+
+def init_memory_service(config, settings):
+    kw = kw_from_settings(settings, "authsanity.memory.")
+
+    if "groupfinder" in kw:
+        kw["groupfinder"] = config.maybe_dotted(kw["groupfinder"])
+
+    register_auth_service(config, settings, MemoryAuthServiceInitializer(**kw))
+
+
+def init_sql_service(config, settings):
+    if "authsanity.sql.connect" not in settings:
+        raise RuntimeError("authsanity.sql.connect is required for the SQL service")
+
+    kw = kw_from_settings(settings, "authsanity.sql.")
+    kw["connect"] = config.maybe_dotted(kw["connect"])
+
+    register_auth_service(config, settings, SQLAuthServiceInitializer(**kw))
+
+
+def init_redis_service(config, settings):
+    kw = kw_from_settings(settings, "authsanity.redis.")
+
+    register_auth_service(config, settings, RedisAuthServiceInitializer(**kw))
+
+
+default_services = {
+    "memory": init_memory_service,
+    "sql": init_sql_service,
+    "redis": init_redis_service,
+}
+
+
 # Stolen from pyramid_debugtoolbar
 def parse_settings(settings):
     parsed = {}
@@ -87,9 +226,40 @@ def includeme(config):
     # include pyramid_services
     config.include("pyramid_services")
 
-    if settings["authsanity.source"] in default_sources:
+    source_names = settings["authsanity.source"].split()
+
+    if len(source_names) > 1:
+        init_composite_source(config, config.registry.settings, source_names)
+    elif settings["authsanity.source"] in default_sources:
         default_sources[settings["authsanity.source"]](config, config.registry.settings)
 
-    config.set_authentication_policy(
-        AuthServicePolicy(debug=settings["authsanity.debug"])
-    )
+    if settings["authsanity.service"] in default_services:
+        default_services[settings["authsanity.service"]](
+            config, config.registry.settings
+        )
+
+    groups_cache = None
+    if settings["authsanity.groups_cache"]:
+        groups_cache = GroupsCache(
+            **kw_from_settings(config.registry.settings, "authsanity.groups_cache.")
+        )
+
+    kw = {
+        "debug": settings["authsanity.debug"],
+        "groups_cache": groups_cache,
+        "stateless_ttl": settings["authsanity.stateless_ttl"],
+        "anonymous_fast_path": settings["authsanity.anonymous_fast_path"],
+        "timeout": settings["authsanity.timeout"],
+        "reissue_time": settings["authsanity.reissue_time"],
+    }
+
+    if settings["authsanity.security_policy"]:
+        policy = AuthServiceSecurityPolicy(**kw)
+        config.set_security_policy(policy)
+    else:
+        policy = AuthServicePolicy(**kw)
+        config.set_authentication_policy(policy)
+
+    # Once everything else has been registered, let the policy resolve what it
+    # needs from the registry
+    config.action(None, lambda: policy.configure(config), order=PHASE3_CONFIG + 1)
@@ -0,0 +1,142 @@
+from pyramid.authorization import ACLAllowed, ACLDenied, Allow
+from pyramid.location import lineage
+from pyramid.util import is_nonstr_iter
+
+from .cache import TTLCache
+
+
+class CompiledACL(object):
+    """An ACL compiled for fast lookups.
+
+    For every permission that is checked the ACL is turned into a mapping of
+    principal to the first ACE that mentions both the principal and the
+    permission. Since the first matching ACE wins, checking a set of
+    principals is a dictionary lookup per principal (or per ACE for the
+    permission, whichever is smaller) instead of a walk over the whole ACL.
+    """
+
+    __slots__ = ("acl", "snapshot", "_permissions")
+
+    def __init__(self, acl):
+        self.acl = acl
+        # Tuples can't change, other ACLs are compared to a copy to detect
+        # changes made in place
+        self.snapshot = None if isinstance(acl, tuple) else list(acl)
+        self._permissions = {}
+
+    def is_current(self, acl):
+        """Returns True if this was compiled from ``acl`` and ``acl`` has not
+        changed since."""
+        if self.acl is not acl:
+            return False
+
+        if self.snapshot is None:
+            return True
+
+        if not isinstance(acl, list):
+            acl = list(acl)
+
+        return acl == self.snapshot
+
+    def _compile(self, permission):
+        table = {}
+
+        for (index, ace) in enumerate(self.acl):
+            (_, ace_principal, ace_permissions) = ace
+
+            if ace_principal in table:
+                continue
+
+            if not is_nonstr_iter(ace_permissions):
+                ace_permissions = [ace_permissions]
+
+            if permission in ace_permissions:
+                table[ace_principal] = (index, ace)
+
+        return table
+
+    def match(self, principals, permission):
+        """Returns the first ACE that matches any of ``principals`` for
+        ``permission``, or None."""
+        try:
+            table = self._permissions[permission]
+        except KeyError:
+            table = self._permissions[permission] = self._compile(permission)
+
+        best = None
+
+        if len(principals) <= len(table):
+            for principal in principals:
+                entry = table.get(principal)
+
+                if entry is not None and (best is None or entry[0] < best[0]):
+                    best = entry
+        else:
+            for (principal, entry) in table.items():
+                if principal in principals and (best is None or entry[0] < best[0]):
+                    best = entry
+
+        return None if best is None else best[1]
+
+
+class CompiledACLHelper(object):
+    """A drop in replacement for :class:`pyramid.authorization.ACLHelper`'s
+    ``permits`` that caches a :class:`CompiledACL` for every ACL it has seen.
+
+    ACLs are cached by identity, which works for the common case of an
+    ``__acl__`` defined on a class or stored on a long lived resource. An ACL
+    that is not a tuple is compared to a copy taken when it was compiled
+    before the compiled form is reused, so changes made to it in place are
+    seen immediately; tuples skip the comparison, use them for the fastest
+    checks. ACLs returned by a callable ``__acl__`` are not cached, as they
+    are usually created anew for every call.
+
+    ``principals`` should be a set (or frozenset), so membership tests are
+    O(1).
+    """
+
+    def __init__(self, max_size=1000):
+        self._cache = TTLCache(max_size=max_size)
+
+    def compile(self, acl):
+        """Returns the cached :class:`CompiledACL` for ``acl``."""
+        key = id(acl)
+        compiled = self._cache.get(key)
+
+        # The cache holds a reference to the ACL, so its id can't be reused
+        # while it is cached
+        if compiled is None or not compiled.is_current(acl):
+            compiled = CompiledACL(acl)
+            self._cache.set(key, compiled)
+
+        return compiled
+
+    def permits(self, context, principals, permission):
+        """Return an instance of :class:`pyramid.authorization.ACLAllowed` if
+        the ACLs in the lineage of ``context`` allow ``permission`` for any of
+        ``principals``, otherwise :class:`pyramid.authorization.ACLDenied`.
+        The semantics are those of :class:`pyramid.authorization.ACLHelper`.
+        """
+        acl = "<No ACL found on any object in resource lineage>"
+
+        for location in lineage(context):
+            try:
+                acl = location.__acl__
+            except AttributeError:
+                continue
+
+            if acl and callable(acl):
+                acl = acl()
+                ace = CompiledACL(acl).match(principals, permission)
+            elif acl:
+                ace = self.compile(acl).match(principals, permission)
+            else:
+                continue
+
+            if ace is not None:
+                if ace[0] == Allow:
+                    return ACLAllowed(ace, acl, permission, principals, location)
+
+                return ACLDenied(ace, acl, permission, principals, location)
+
+        return ACLDenied("<default deny>", acl, permission, principals, context)
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import threading
+import time
+
+_marker = object()
+
+
+class TTLCache(object):
+    """A bounded mapping with per-entry expiration and least recently used
+    eviction.
+
+    Entries are spread across ``shards`` independently locked ordered
+    dictionaries, so that threads working on different keys do not all
+    serialize on a single mutex. Lookups, inserts and removals are O(1).
+
+    ``max_size`` is the total number of entries, split evenly across shards,
+    once a shard is full the least recently used entry in that shard is
+    evicted. ``ttl`` is the default lifetime of an entry in seconds, ``None``
+    means entries only leave the cache by being evicted or removed.
+
+    The number of lookups that found (``hits``) or did not find (``misses``)
+    a live entry is counted, which helps choosing ``max_size``.
+    """
+
+    def __init__(self, max_size=10000, ttl=None, shards=16, clock=time.monotonic):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+
+        self.ttl = ttl
+        self.clock = clock
+        self.shard_size = max(1, -(-max_size // shards))
+        self._shards = [
+            (OrderedDict(), threading.Lock(), [0, 0]) for _ in range(shards)
+        ]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key, default=None):
+        """Return the value for ``key``, or ``default`` if it does not exist
+        or has expired."""
+        (data, lock, stats) = self._shard(key)
+
+        with lock:
+            entry = data.get(key, _marker)
+
+            if entry is _marker:
+                stats[1] += 1
+                return default
+
+            (value, expires) = entry
+
+            if expires is not None and expires <= self.clock():
+                del data[key]
+                stats[1] += 1
+                return default
+
+            data.move_to_end(key)
+            stats[0] += 1
+            return value
+
+    def set(self, key, value, ttl=_marker):
+        """Store ``value`` for ``key``. ``ttl`` overrides the default lifetime
+        for this entry."""
+        if ttl is _marker:
+            ttl = self.ttl
+
+        expires = None if ttl is None else self.clock() + ttl
+        (data, lock, _) = self._shard(key)
+
+        with lock:
+            data[key] = (value, expires)
+            data.move_to_end(key)
+
+            while len(data) > self.shard_size:
+                data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove ``key``, returns True if it was present."""
+        (data, lock, _) = self._shard(key)
+
+        with lock:
+            return data.pop(key, _marker) is not _marker
+
+    def clear(self):
+        for (data, lock, _) in self._shards:
+            with lock:
+                data.clear()
+
+    @property
+    def hits(self):
+        return sum(stats[0] for (_, _, stats) in self._shards)
+
+    @property
+    def misses(self):
+        return sum(stats[1] for (_, _, stats) in self._shards)
+
+    def __len__(self):
+        return sum(len(data) for (data, _, _) in self._shards)
+
+
+class GroupsCache(object):
+    """Caches the groups of a principal, for use by
+    :class:`pyramid_authsanity.AuthServicePolicy`.
+
+    Every entry is tagged with the generation it was stored in. Calling
+    :meth:`invalidate` starts a new generation, which makes every existing
+    entry stale in O(1) without scanning the cache, use it whenever group
+    membership changes in a way that may affect many principals. A single
+    principal may be dropped using :meth:`invalidate_principal`.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, shards=16, clock=time.monotonic):
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._cache = TTLCache(max_size=max_size, ttl=ttl, shards=shards, clock=clock)
+
+    def get(self, principal):
+        """Returns the cached groups as a list, or None."""
+        entry = self._cache.get(principal)
+
+        if entry is None or entry[0] != self.generation:
+            return None
+
+        return list(entry[1])
+
+    def set(self, principal, groups, generation=None):
+        """Store the groups for principal. Pass the ``generation`` that was
+        current before the groups were looked up, so that groups fetched
+        before an :meth:`invalidate` are not stored as current."""
+        if generation is None:
+            generation = self.generation
+
+        self._cache.set(principal, (generation, tuple(groups)))
+
+    def invalidate(self):
+        """Invalidate all cached groups."""
+        with self._lock:
+            self.generation += 1
+
+    def invalidate_principal(self, principal):
+        """Invalidate the cached groups for a single principal."""
+        self._cache.delete(principal)
@@ -45,3 +45,9 @@ class IAuthService(Interface):
 
     def remove_ticket(ticket):
         """Remove a ticket for the current user. Upon success return True"""
+
+    # Authentication services may optionally provide an
+    # ``extend_ticket(principal, ticket)`` method, which is called when the
+    # authentication policy reissues a ticket (see the ``timeout`` argument to
+    # the policy) so that the ticket's lifetime in the service can be
+    # extended as well.
@@ -1,11 +1,25 @@
 import base64
 import os
+import time
 
 from pyramid.authorization import Authenticated, Everyone
-from pyramid.interfaces import IAuthenticationPolicy, IDebugLogger
+from pyramid.interfaces import (
+    IAuthenticationPolicy,
+    IDebugLogger,
+    ISecurityPolicy,
+    ISessionFactory,
+)
+from pyramid_services import find_service_factory
 from zope.interface import implementer
 
-from .util import _find_services, _session_registered, add_vary_callback
+from .acl import CompiledACLHelper
+from .interfaces import IAuthSourceService
+from .util import (
+    _find_services,
+    _request_cache,
+    _session_registered,
+    add_vary_callback,
+)
 
 
 def _clean_principal(princid):
@@ -19,12 +33,29 @@ def _clean_principal(princid):
 
 
 _marker = object()
+_anonymous_principals = frozenset([Everyone])
+
+
+def _vary_callback(request, response):
+    sourcesvc = _request_cache(request)["vary"]
+    add_vary_callback(sourcesvc.vary)(request, response)
+
+
+def _reissue_callback(request, response):
+    entry = _request_cache(request).pop("reissue", None)
+
+    # remember() or forget() cancel the reissue
+    if entry is not None:
+        (sourcesvc, value) = entry
+        response.headerlist.extend(sourcesvc.headers_remember(value))
 
 
 @implementer(IAuthenticationPolicy)
 class AuthServicePolicy(object):
     def _log(self, msg, methodname, request):
-        logger = request.registry.queryUtility(IDebugLogger)
+        logger = self._logger
+        if logger is _marker:
+            logger = request.registry.queryUtility(IDebugLogger)
         if logger:
             cls = self.__class__
             classname = cls.__module__ + "." + cls.__name__
@@ -33,20 +64,196 @@ class AuthServicePolicy(object):
 
     _find_services = staticmethod(_find_services)  # Testing
     _session_registered = staticmethod(_session_registered)  # Testing
-    _have_session = _marker
 
-    def __init__(self, debug=False):
+    # Resolved by configure()
+    _have_session = _marker
+    _logger = _marker
+    _vary_callback = None
+
+    def __init__(
+        self,
+        debug=False,
+        groups_cache=None,
+        stateless_ttl=None,
+        anonymous_fast_path=True,
+        timeout=None,
+        reissue_time=None,
+    ):
         self.debug = debug
+        self.groups_cache = groups_cache
+        self.stateless_ttl = stateless_ttl
+        self.anonymous_fast_path = anonymous_fast_path
+        self.timeout = timeout
+
+        if reissue_time is None and timeout is not None:
+            reissue_time = timeout / 2
+
+        self.reissue_time = reissue_time
+
+    def configure(self, config):
+        """Resolve everything the policy needs from the registry of the
+        configurator ``config``: whether
+        there is a session factory, the debug logger and, if the source's
+        ``vary`` is a fixed list, the callback adding it to responses.
+
+        This is called by ``includeme`` once the configuration has been
+        committed, so that requests never have to query the registry for
+        these, nor modify the policy. A policy that was not configured looks
+        them up on every request instead.
+        """
+        registry = config.registry
+        self._have_session = registry.queryUtility(ISessionFactory) is not None
+        self._logger = registry.queryUtility(IDebugLogger)
+
+        try:
+            source = find_service_factory(config, IAuthSourceService)
+        except LookupError:
+            source = None
+
+        vary = getattr(source, "vary", None)
+
+        if isinstance(vary, (list, tuple)):
+            self._vary_callback = add_vary_callback(vary)
+
+    def _has_session(self, request):
+        if self._have_session is _marker:
+            return self._session_registered(request)
+
+        return self._have_session
+
+    def _add_vary_callback(self, request, sourcesvc):
+        """Schedule the Vary header to be added to the response, this is only
+        done once per request. Unless the source's ``vary`` was resolved by
+        :meth:`configure` it is read when the response is created, as it may
+        depend on what the source was asked."""
+        cache = _request_cache(request)
+
+        if "vary" not in cache:
+            cache["vary"] = sourcesvc
+            request.add_response_callback(self._vary_callback or _vary_callback)
+
+    def _clear_identity(self, request):
+        """Drop the memoized identity for this request."""
+        cache = _request_cache(request)
+        cache.pop("userid", None)
+        cache.pop("principals", None)
+        cache.pop("identity", None)
+        cache.pop("stateless", None)
+        cache.pop("reissue", None)
+
+    def _value(self, principal, ticket, groups=None):
+        """Returns the value to be stored by the source service."""
+        value = [principal, ticket]
+
+        if self.stateless_ttl is not None or self.timeout is not None:
+            issued = int(time.time())
+            ttl = self.stateless_ttl
+
+            if ttl is None:
+                ttl = self.timeout
+
+            value.extend(
+                [issued, issued + ttl, None if groups is None else list(groups)]
+            )
+
+        return value
+
+    def _timed_out(self, value):
+        """Returns True if ``value`` was issued more than ``timeout`` seconds
+        ago."""
+        if self.timeout is None or len(value) < 5:
+            return False
+
+        try:
+            return time.time() - value[2] > self.timeout
+        except TypeError:
+            return True
+
+    def _reissue(self, request, sourcesvc, authsvc, value):
+        """Schedule the value to be stored again with a new issue time, if
+        ``reissue_time`` seconds have passed since it was issued. Stateless
+        values are only verified once they expired, so they are always
+        reissued, with the groups the authentication service now returns."""
+        stateless = self.stateless_ttl is not None
+
+        if (
+            not stateless
+            and len(value) >= 5
+            and time.time() - value[2] < self.reissue_time
+        ):
+            return
+
+        (principal, ticket) = (value[0], value[1])
+        groups = value[4] if len(value) >= 5 else None
+
+        if stateless and groups is not None:
+            groups = list(authsvc.groups())
+
+        # Let the authentication service extend the ticket, if it supports it
+        extend_ticket = getattr(authsvc, "extend_ticket", None)
+        if extend_ticket is not None:
+            extend_ticket(principal, ticket)
+
+        _request_cache(request)["reissue"] = (
+            sourcesvc,
+            self._value(principal, ticket, groups),
+        )
+        request.add_response_callback(_reissue_callback)
+
+    def _stateless(self, value):
+        """Returns ``(principal, ticket, groups)`` if ``value`` is a stateless
+        ticket whose embedded expiry has not yet passed, otherwise None.
+        ``groups`` is None if no groups were embedded."""
+        if self.stateless_ttl is None or len(value) < 5:
+            return None
+
+        try:
+            (principal, ticket, issued, expires, groups) = value[:5]
+
+            if principal is None or not expires > time.time():
+                return None
+
+            if groups is not None:
+                groups = [str(group) for group in groups]
+        except (TypeError, ValueError):
+            return None
+
+        return (principal, ticket, groups)
 
     def unauthenticated_userid(self, request):
         """We do not allow the unauthenticated userid to be used."""
 
     def authenticated_userid(self, request):
-        """Returns the authenticated userid for this request."""
+        """Returns the authenticated userid for this request.
+
+        The result is memoized on the request, so the source and
+        authentication services are only consulted once per request. Unless
+        ``anonymous_fast_path`` is disabled, a request whose source provides
+        neither a principal nor a ticket is anonymous without consulting the
+        authentication service.
+        """
         debug = self.debug
 
+        cache = _request_cache(request)
+        if "userid" in cache:
+            return cache["userid"]
+
         (sourcesvc, authsvc) = self._find_services(request)
-        request.add_response_callback(add_vary_callback(sourcesvc.vary))
+        self._add_vary_callback(request, sourcesvc)
+
+        value = None
+
+        if self.anonymous_fast_path:
+            value = sourcesvc.get_value()
+
+            if value[0] is None and value[1] is None:
+                debug and self._log(
+                    "source service provided no credentials; returning None",
+                    "authenticated_userid",
+                    request,
+                )
+                cache["userid"] = None
+                return None
 
         try:
             userid = authsvc.userid()
@@ -56,7 +263,9 @@ class AuthServicePolicy(object):
                 "authenticated_userid",
                 request,
             )
-            (principal, ticket) = sourcesvc.get_value()
+            if value is None:
+                value = sourcesvc.get_value()
+            (principal, ticket) = (value[0], value[1])
 
             debug and self._log(
                 "source service provided information: (principal: %r, ticket: %r)"
@@ -65,14 +274,39 @@ class AuthServicePolicy(object):
                 request,
             )
 
-            # Verify the principal and the ticket, even if None
-            authsvc.verify_ticket(principal, ticket)
+            stateless = self._stateless(value)
 
-            try:
-                # This should now return None or the userid
-                userid = authsvc.userid()
-            except Exception:
+            if self._timed_out(value):
+                debug and self._log(
+                    "ticket has timed out; returning None",
+                    "authenticated_userid",
+                    request,
+                )
                 userid = None
+            elif stateless is not None:
+                # The signed value vouches for the principal until it expires,
+                # the authentication service is not consulted
+                debug and self._log(
+                    "accepting unexpired stateless ticket",
+                    "authenticated_userid",
+                    request,
+                )
+                cache["stateless"] = stateless
+                userid = principal
+            else:
+                # Verify the principal and the ticket, even if None
+                authsvc.verify_ticket(principal, ticket)
+
+                try:
+                    # This should now return None or the userid
+                    userid = authsvc.userid()
+                except Exception:
+                    userid = None
+
+                if userid is not None and (
+                    self.timeout is not None or self.stateless_ttl is not None
+                ):
+                    self._reissue(request, sourcesvc, authsvc, value)
 
         debug and self._log(
             "authenticated_userid returning: %r" % (userid,),
@@ -80,15 +314,24 @@ class AuthServicePolicy(object):
             request,
         )
 
+        cache["userid"] = userid
         return userid
 
     def effective_principals(self, request):
-        """A list of effective principals derived from request."""
+        """A list of effective principals derived from request.
+
+        The result is memoized on the request, a copy is returned so that
+        callers may freely modify the list.
+        """
         debug = self.debug
+
+        cache = _request_cache(request)
+        if "principals" in cache:
+            return list(cache["principals"])
+
         effective_principals = [Everyone]
 
         userid = self.authenticated_userid(request)
-        (_, authsvc) = self._find_services(request)
 
         if userid is None:
             debug and self._log(
@@ -97,7 +340,8 @@ class AuthServicePolicy(object):
                 "effective_principals",
                 request,
             )
-            return effective_principals
+            cache["principals"] = effective_principals
+            return list(effective_principals)
 
         if _clean_principal(userid) is None:
             debug and self._log(
@@ -108,37 +352,83 @@ class AuthServicePolicy(object):
                 "effective_principals",
                 request,
             )
-            return effective_principals
+            cache["principals"] = effective_principals
+            return list(effective_principals)
+
+        (_, authsvc) = self._find_services(request)
 
         effective_principals.append(Authenticated)
         effective_principals.append(userid)
-        effective_principals.extend(authsvc.groups())
+        effective_principals.extend(
+            self._groups(userid, authsvc, cache.get("stateless"))
+        )
 
         debug and self._log(
             "returning effective principals: %r" % (effective_principals,),
             "effective_principals",
             request,
         )
-        return effective_principals
+        cache["principals"] = effective_principals
+        return list(effective_principals)
+
+    def _groups(self, userid, authsvc, stateless=None):
+        """Returns the groups for userid, using the groups embedded in a
+        stateless ticket or the groups cache if there is one."""
+        if stateless is not None and stateless[2] is not None:
+            return stateless[2]
+
+        groups_cache = self.groups_cache
+
+        if groups_cache is None:
+            return self._service_groups(authsvc, stateless)
+
+        generation = groups_cache.generation
+        groups = groups_cache.get(userid)
+
+        if groups is None:
+            groups = self._service_groups(authsvc, stateless)
+            groups_cache.set(userid, groups, generation)
 
-    def remember(self, request, principal, **kw):
-        """Returns a list of headers that are to be set from the source service."""
+        return groups
+
+    def _service_groups(self, authsvc, stateless):
+        if stateless is not None:
+            # A stateless ticket was accepted without verifying it, the
+            # authentication service needs to verify it to know the user
+            authsvc.verify_ticket(stateless[0], stateless[1])
+
+        return authsvc.groups()
+
+    def remember(self, request, principal, groups=None, **kw):
+        """Returns a list of headers that are to be set from the source service.
+
+        If the policy was created with a ``stateless_ttl`` or a ``timeout``
+        the stored value also contains the time it was issued, the time it
+        expires and ``groups``, which is embedded as is and used instead of
+        asking the authentication service for the user's groups.
+
+        If a session factory is registered the session is invalidated when
+        ``principal`` is not the user that is currently logged in. When it is
+        the same user the session keeps its data but gets a new id, using the
+        session's ``regenerate_id()`` method if it has one (otherwise the
+        data is copied into a new session), and ``new_csrf_token()`` is then
+        called on it.
+        """
         debug = self.debug
 
-        if self._have_session is _marker:
-            self._have_session = self._session_registered(request)
+        have_session = self._has_session(request)
 
-        prev_userid = self.authenticated_userid(request)
+        # The previous userid is only needed to decide what happens to the
+        # session
+        prev_userid = None
+        if have_session:
+            prev_userid = self.authenticated_userid(request)
 
         (sourcesvc, authsvc) = self._find_services(request)
 
-        request.add_response_callback(add_vary_callback(sourcesvc.vary))
+        self._add_vary_callback(request, sourcesvc)
 
-        value = {}
-        value["principal"] = principal
-        value["ticket"] = ticket = (
-            base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
-        )
+        ticket = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b"=").decode("ascii")
 
         debug and self._log(
             "Remember principal: %r, ticket: %r" % (principal, ticket),
@@ -148,39 +438,164 @@ class AuthServicePolicy(object):
 
         authsvc.add_ticket(principal, ticket)
 
+        # The identity for this request has changed
+        self._clear_identity(request)
+
         # Clear the previous session
-        if self._have_session:
+        if have_session:
             if prev_userid != principal:
                 request.session.invalidate()
             else:
                 # We are logging in the same user that is already logged in, we
                 # still want to generate a new session, but we can keep the
                 # existing data
-                data = dict(request.session.items())
-                request.session.invalidate()
-                request.session.update(data)
+                self._rotate_session(request.session)
                 request.session.new_csrf_token()
 
-        return sourcesvc.headers_remember([principal, ticket])
+        return sourcesvc.headers_remember(self._value(principal, ticket, groups))
+
+    def _rotate_session(self, session):
+        """Give the session a new id while keeping its data.
+
+        Sessions that provide a ``regenerate_id()`` method are asked to do so
+        in place, otherwise the data is copied into a new session.
+        """
+        regenerate_id = getattr(session, "regenerate_id", None)
+
+        if regenerate_id is not None:
+            regenerate_id()
+        else:
+            data = dict(session.items())
+            session.invalidate()
+            session.update(data)
 
     def forget(self, request):
         """A list of headers which will delete appropriate cookies."""
         debug = self.debug
 
-        if self._have_session is _marker:
-            self._have_session = self._session_registered(request)
+        have_session = self._has_session(request)
 
         (sourcesvc, authsvc) = self._find_services(request)
 
-        request.add_response_callback(add_vary_callback(sourcesvc.vary))
+        self._add_vary_callback(request, sourcesvc)
 
-        (_, ticket) = sourcesvc.get_value()
+        ticket = sourcesvc.get_value()[1]
 
         debug and self._log("Forgetting ticket: %r" % (ticket,), "forget", request)
         authsvc.remove_ticket(ticket)
 
+        # The identity for this request has changed
+        self._clear_identity(request)
+
         # Clear the session by invalidating it
-        if self._have_session:
+        if have_session:
             request.session.invalidate()
 
         return sourcesvc.headers_forget()
+
+
+class Identity(object):
+    """The identity of an authenticated user, as returned by
+    :meth:`AuthServiceSecurityPolicy.identity`. ``principals`` is a
+    frozenset of the user's effective principals."""
+
+    __slots__ = ("userid", "principals")
+
+    def __init__(self, userid, principals):
+        self.userid = userid
+        self.principals = frozenset(principals)
+
+    def __repr__(self):
+        return "<Identity userid=%r principals=%r>" % (
+            self.userid,
+            sorted(self.principals),
+        )
+
+
+@implementer(ISecurityPolicy)
+class AuthServiceSecurityPolicy(object):
+    """A Pyramid security policy using the authentication source and
+    authentication services, with ACL based authorization.
+
+    Uses an :class:`AuthServicePolicy` to compute the userid and effective
+    principals, the :class:`Identity` built from them is resolved once per
+    request and reused by every call to :meth:`permits`. ACLs are checked
+    using a :class:`pyramid_authsanity.acl.CompiledACLHelper`, unless another
+    helper is passed as ``acl_helper``.
+    """
+
+    def __init__(
+        self,
+        debug=False,
+        groups_cache=None,
+        authn_policy=None,
+        acl_helper=None,
+        stateless_ttl=None,
+        anonymous_fast_path=True,
+        timeout=None,
+        reissue_time=None,
+    ):
+        if authn_policy is None:
+            authn_policy = AuthServicePolicy(
+                debug=debug,
+                groups_cache=groups_cache,
+                stateless_ttl=stateless_ttl,
+                anonymous_fast_path=anonymous_fast_path,
+                timeout=timeout,
+                reissue_time=reissue_time,
+            )
+
+        if acl_helper is None:
+            acl_helper = CompiledACLHelper()
+
+        self.authn_policy = authn_policy
+        self.acl_helper = acl_helper
+
+    def configure(self, config):
+        """See :meth:`AuthServicePolicy.configure`."""
+        self.authn_policy.configure(config)
+
+    def identity(self, request):
+        """Returns an :class:`Identity` for the authenticated user, or None."""
+        cache = _request_cache(request)
+
+        try:
+            return cache["identity"]
+        except KeyError:
+            pass
+
+        authn_policy = self.authn_policy
+        userid = authn_policy.authenticated_userid(request)
+        identity = None
+
+        if _clean_principal(userid) is not None:
+            identity = Identity(userid, authn_policy.effective_principals(request))
+
+        cache["identity"] = identity
+        return identity
+
+    def authenticated_userid(self, request):
+        """Returns the authenticated userid for this request."""
+        identity = self.identity(request)
+
+        return None if identity is None else identity.userid
+
+    def permits(self, request, context, permission):
+        """Check the ACL of the context (and its lineage) against the
+        principals of the current identity."""
+        identity = self.identity(request)
+        if identity is None:
+            principals = _anonymous_principals
+        else:
+            principals = identity.principals
+
+        return self.acl_helper.permits(context, principals, permission)
+
+    def remember(self, request, userid, **kw):
+        """Returns a list of headers that are to be set from the source
+        service."""
+        return self.authn_policy.remember(request, userid, **kw)
+
+    def forget(self, request, **kw):
+        """A list of headers which will delete appropriate cookies."""
+        return self.authn_policy.forget(request)
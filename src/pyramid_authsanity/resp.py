@@ -0,0 +1,237 @@
+import socket
+
+from zope.interface import implementer
+
+from .interfaces import IAuthService
+from .sql import ConnectionPool
+
+_marker = object()
+
+
+class RESPError(Exception):
+    """An error reply sent by the server."""
+
+
+def _encode(arg):
+    if isinstance(arg, bytes):
+        return arg
+
+    if isinstance(arg, str):
+        return arg.encode("utf-8")
+
+    return str(arg).encode("ascii")
+
+
+def encode_command(*args):
+    """Encodes a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % (len(args),)]
+
+    for arg in args:
+        arg = _encode(arg)
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+    return b"".join(parts)
+
+
+class RESPConnection(object):
+    """A connection to a server speaking the Redis serialization protocol
+    (RESP), such as Redis, Valkey or KeyDB.
+
+    Commands are sent with :meth:`execute`, which pipelines them: all the
+    commands are written at once and then all the replies are read, so a
+    batch of commands costs a single round trip. If ``password`` is set the
+    connection is authenticated, and database ``db`` is selected when it is
+    not 0, both in the same round trip.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+
+        commands = []
+
+        if password is not None:
+            commands.append(("AUTH", password))
+
+        if db:
+            commands.append(("SELECT", db))
+
+        if commands:
+            try:
+                self.execute(*commands)
+            except Exception:
+                self.close()
+                raise
+
+    def execute(self, *commands):
+        """Sends every command in ``commands``, each a tuple of arguments, and
+        returns the list of replies. Bulk strings are returned as bytes. If
+        any reply is an error, :class:`RESPError` is raised once every reply
+        has been read."""
+        self._sock.sendall(b"".join(encode_command(*command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+
+        for reply in replies:
+            if isinstance(reply, RESPError):
+                raise reply
+
+        return replies
+
+    def _readline(self):
+        line = self._file.readline()
+
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the server")
+
+        return line[:-2]
+
+    def _read_reply(self):
+        line = self._readline()
+        (kind, payload) = (line[:1], line[1:])
+
+        if kind == b"+":
+            return payload.decode("utf-8")
+
+        if kind == b"-":
+            return RESPError(payload.decode("utf-8"))
+
+        if kind == b":":
+            return int(payload)
+
+        if kind == b"$":
+            length = int(payload)
+
+            if length < 0:
+                return None
+
+            data = self._file.read(length + 2)
+
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the server")
+
+            return data[:-2]
+
+        if kind == b"*":
+            length = int(payload)
+
+            if length < 0:
+                return None
+
+            return [self._read_reply() for _ in range(length)]
+
+        raise RESPError("Unexpected reply: %r" % (line,))
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._sock.close()
+
+
+def RedisAuthServiceInitializer(
+    host="localhost",
+    port=6379,
+    db=0,
+    password=None,
+    timeout=None,
+    pool_size=5,
+    ttl=None,
+    prefix="authsanity:",
+    pool=None,
+):
+    """An authentication service that stores tickets in Redis, or any other
+    server speaking the Redis serialization protocol.
+
+    Connections are kept in a :class:`pyramid_authsanity.sql.ConnectionPool`
+    of ``pool_size`` connections. ``ttl`` is the number of seconds a new
+    ticket is valid, ``None`` means tickets do not expire. Keys are prefixed
+    with ``prefix``:
+
+    - ``<prefix>ticket:<ticket>`` is a string holding the ticket's principal
+      (principals that are not strings, such as integers, are stored in their
+      string form), expiring with the ticket.
+    - ``<prefix>groups:<principal>`` is a set holding the principal's groups,
+      it is maintained by the application.
+
+    ``GET`` on the ticket and ``SMEMBERS`` on the groups are pipelined when
+    the ticket is verified, so a request costs one round trip to the server.
+    A command that fails because a pooled connection was closed (for instance
+    by the server's idle timeout) is retried once on a new connection.
+    """
+
+    if pool is None:
+        pool = ConnectionPool(
+            lambda: RESPConnection(
+                host=host, port=port, db=db, password=password, timeout=timeout
+            ),
+            size=pool_size,
+        )
+
+    # Principals that are not strings (integer userids) are stored and
+    # compared in their string form
+    ticket_key = _encode(prefix + "ticket:")
+    groups_key = _encode(prefix + "groups:")
+
+    def execute(*commands):
+        try:
+            with pool.connection() as conn:
+                return conn.execute(*commands)
+        except ConnectionError:
+            # All the commands used are idempotent
+            with pool.connection() as conn:
+                return conn.execute(*commands)
+
+    @implementer(IAuthService)
+    class RedisAuthService(object):
+        def __init__(self, context, request):
+            self._userid = _marker
+            self._groups = []
+
+        def userid(self):
+            if self._userid is _marker:
+                raise ValueError("No ticket has been verified")
+
+            return self._userid
+
+        def groups(self):
+            return list(self._groups)
+
+        def verify_ticket(self, principal, ticket):
+            self._userid = None
+            self._groups = []
+
+            if principal is None or ticket is None:
+                return
+
+            (stored, groups) = execute(
+                ("GET", ticket_key + _encode(ticket)),
+                ("SMEMBERS", groups_key + _encode(principal)),
+            )
+
+            if stored is not None and stored == _encode(principal):
+                self._userid = principal
+                self._groups = sorted(group.decode("utf-8") for group in groups)
+
+        def add_ticket(self, principal, ticket):
+            command = ("SET", ticket_key + _encode(ticket), _encode(principal))
+
+            if ttl is not None:
+                command += ("EX", ttl)
+
+            execute(command)
+
+        def extend_ticket(self, principal, ticket):
+            if ttl is not None:
+                execute(("EXPIRE", ticket_key + _encode(ticket), ttl))
+
+        def remove_ticket(self, ticket):
+            if ticket is None:
+                return False
+
+            (removed,) = execute(("DEL", ticket_key + _encode(ticket)))
+            return removed > 0
+
+    RedisAuthService.pool = pool
+
+    return RedisAuthService
@@ -0,0 +1,177 @@
+from zope.interface import implementer
+
+from .cache import TTLCache
+from .interfaces import IAuthService
+
+_marker = object()
+
+
+def MemoryAuthServiceInitializer(
+    max_size=10000,
+    ttl=None,
+    shards=16,
+    groupfinder=None,
+    store=None,
+):
+    """An authentication service that keeps tickets in memory.
+
+    Tickets are stored in a :class:`pyramid_authsanity.cache.TTLCache` that is
+    shared by all requests, every ticket expires ``ttl`` seconds after it was
+    added and once ``max_size`` tickets are stored the least recently used
+    ones are evicted. Tickets do not survive a restart and are not shared
+    between processes, this is meant for small deployments and test suites.
+
+    ``groupfinder`` is an optional callable accepting a userid and the request
+    that returns the groups the user is a member of.
+    """
+
+    if store is None:
+        store = TTLCache(max_size=max_size, ttl=ttl, shards=shards)
+
+    @implementer(IAuthService)
+    class MemoryAuthService(object):
+        def __init__(self, context, request):
+            self.request = request
+            self._userid = _marker
+
+        def userid(self):
+            if self._userid is _marker:
+                raise ValueError("No ticket has been verified")
+
+            return self._userid
+
+        def groups(self):
+            if groupfinder is None or self._userid in (None, _marker):
+                return []
+
+            return list(groupfinder(self._userid, self.request))
+
+        def verify_ticket(self, principal, ticket):
+            self._userid = None
+
+            if principal is not None and store.get(ticket) == principal:
+                self._userid = principal
+
+        def add_ticket(self, principal, ticket):
+            store.set(ticket, principal)
+
+        def extend_ticket(self, principal, ticket):
+            if store.get(ticket) == principal:
+                store.set(ticket, principal)
+
+        def remove_ticket(self, ticket):
+            return store.delete(ticket)
+
+    MemoryAuthService.store = store
+
+    return MemoryAuthService
+
+
+def CachingAuthServiceInitializer(
+    service,
+    max_size=10000,
+    ttl=30,
+    negative_ttl=_marker,
+    cache=None,
+):
+    """Wraps the authentication service factory ``service`` and caches the
+    result of ``verify_ticket`` in memory, shared between requests.
+
+    Both valid and invalid tickets are cached, for ``ttl`` and
+    ``negative_ttl`` (defaults to ``ttl``) seconds respectively. Removing or
+    adding a ticket through the wrapper removes it from the cache immediately,
+    tickets removed directly from the backend (or by another process) remain
+    valid until their cache entry expires, so keep ``ttl`` short.
+
+    ``cache`` may be any object with the same ``get``, ``set`` and ``delete``
+    methods as :class:`pyramid_authsanity.cache.TTLCache`, by default a new
+    one holding ``max_size`` entries is created.
+
+    When a ticket is found in the cache the wrapped service is only asked to
+    verify the ticket if ``groups`` is called.
+    """
+
+    if negative_ttl is _marker:
+        negative_ttl = ttl
+
+    if cache is None:
+        cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    @implementer(IAuthService)
+    class CachingAuthService(object):
+        def __init__(self, context, request):
+            self.context = context
+            self.request = request
+            self._service = None
+            self._userid = _marker
+            self._pending = None
+
+        @property
+        def service(self):
+            """The wrapped authentication service, created on first use."""
+            if self._service is None:
+                self._service = service(self.context, self.request)
+
+            return self._service
+
+        def userid(self):
+            if self._userid is _marker:
+                return self.service.userid()
+
+            return self._userid
+
+        def groups(self):
+            if self._pending is not None:
+                # The ticket was verified using the cache, the wrapped service
+                # has to verify it before it is able to return groups
+                (principal, ticket) = self._pending
+                self._pending = None
+                self.service.verify_ticket(principal, ticket)
+
+            return self.service.groups()
+
+        def verify_ticket(self, principal, ticket):
+            self._userid = _marker
+            self._pending = None
+
+            if ticket is None:
+                return self.service.verify_ticket(principal, ticket)
+
+            entry = cache.get(ticket)
+
+            if entry is not None and entry[0] == principal:
+                self._userid = entry[1]
+                self._pending = (principal, ticket)
+                return
+
+            svc = self.service
+            svc.verify_ticket(principal, ticket)
+
+            try:
+                userid = svc.userid()
+            except Exception:
+                userid = None
+
+            cache.set(
+                ticket,
+                (principal, userid),
+                ttl=ttl if userid is not None else negative_ttl,
+            )
+
+        def add_ticket(self, principal, ticket):
+            self.service.add_ticket(principal, ticket)
+            cache.delete(ticket)
+
+        def extend_ticket(self, principal, ticket):
+            extend_ticket = getattr(self.service, "extend_ticket", None)
+
+            if extend_ticket is not None:
+                extend_ticket(principal, ticket)
+
+        def remove_ticket(self, ticket):
+            cache.delete(ticket)
+            return self.service.remove_ticket(ticket)
+
+    CachingAuthService.cache = cache
+
+    return CachingAuthService
@@ -0,0 +1,286 @@
+from hashlib import blake2b
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_marker = object()
+
+_MAGIC = b"ASANSHM1"
+_header = struct.Struct(">8sII16s")
+
+# Every slot is a checksum over the rest of the slot, followed by the key
+# hash, the expiration time and the length of the value, and then the value
+_checksum_size = 8
+_slot_header = struct.Struct(">16sdH")
+_slot_header_size = _checksum_size + _slot_header.size
+_empty_checksum = b"\x00" * _checksum_size
+
+
+def _same_file(fd, path):
+    (opened, current) = (os.fstat(fd), os.stat(path))
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+class SharedMemoryCache(object):
+    """A fixed size cache in shared memory, for use by several processes.
+
+    The cache is a table of ``max_size`` slots in a memory mapping, keys are
+    hashed into the table using open addressing: an entry is stored in one of
+    the ``probes`` slots following the key's hash, replacing an empty,
+    expired or the soonest to expire entry. Only a keyed hash of the key is
+    stored, not the key itself. Values are serialized as JSON and may be at
+    most ``value_size`` bytes, larger values are not cached. ``ttl`` is the
+    default lifetime of an entry in seconds.
+
+    There are no locks. Every slot holds a checksum, keyed with a random
+    secret stored in the mapping, over its contents, a slot that is being
+    written while it is read (or written by two processes at once) fails the
+    checksum and is treated as missing. As with any cache, entries may
+    disappear at any time.
+
+    Without a ``path`` the mapping is anonymous and only shared with processes
+    forked after the cache was created, such as the workers of a pre-forking
+    server that loads the application before forking (``--preload`` for
+    gunicorn). With a ``path`` the mapping is backed by that file, and every
+    process using the same path and parameters shares the cache; the file is
+    created if needed, a file created with other parameters is replaced by a
+    new one (processes using the old file keep using it until they restart).
+
+    Keys must be strings (or bytes), with the same methods as
+    :class:`pyramid_authsanity.cache.TTLCache` it may be used as the cache of
+    :func:`pyramid_authsanity.services.CachingAuthServiceInitializer`. The
+    ``hits`` and ``misses`` counters are per process.
+    """
+
+    def __init__(
+        self,
+        max_size=10000,
+        ttl=None,
+        value_size=256,
+        probes=8,
+        path=None,
+        clock=time.time,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.ttl = ttl
+        self.clock = clock
+        self.slots = max_size
+        self.value_size = value_size
+        self.probes = min(probes, max_size)
+        self.slot_size = _slot_header_size + value_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        size = _header.size + self.slots * self.slot_size
+
+        if path is None:
+            self._mm = mmap.mmap(-1, size)
+            self._initialize()
+        else:
+            self._mm = self._open(path, size)
+
+        (_, _, _, self._secret) = _header.unpack_from(self._mm, 0)
+
+    def _initialize(self):
+        self._mm[: _header.size] = _header.pack(
+            _MAGIC, self.slots, self.slot_size, os.urandom(16)
+        )
+
+    def _open(self, path, size):
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+            try:
+                if fcntl is not None:
+                    # Serialize initialization between processes starting
+                    # together, closing the file releases the lock
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+
+                # The file may have been replaced while waiting for the lock
+                if not _same_file(fd, path):
+                    continue
+
+                if self._compatible(fd, size):
+                    return mmap.mmap(fd, size)
+
+                # Other processes may still have the existing file mapped,
+                # resetting it in place would pull it from under them
+                new_fd = self._create(path, size)
+
+                try:
+                    return mmap.mmap(new_fd, size)
+                finally:
+                    os.close(new_fd)
+            finally:
+                os.close(fd)
+
+    def _compatible(self, fd, size):
+        if os.fstat(fd).st_size != size:
+            return False
+
+        os.lseek(fd, 0, os.SEEK_SET)
+        (magic, slots, slot_size, _) = _header.unpack(os.read(fd, _header.size))
+        return (magic, slots, slot_size) == (_MAGIC, self.slots, self.slot_size)
+
+    def _create(self, path, size):
+        """Creates a new, empty cache file and moves it to ``path``, returns
+        its file descriptor."""
+        (fd, tmp) = tempfile.mkstemp(
+            prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or "."
+        )
+
+        try:
+            os.ftruncate(fd, size)
+            os.write(
+                fd, _header.pack(_MAGIC, self.slots, self.slot_size, os.urandom(16))
+            )
+            os.replace(tmp, path)
+        except Exception:  # pragma: no cover
+            os.close(fd)
+            os.unlink(tmp)
+            raise
+
+        return fd
+
+    def _hash(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+
+        return blake2b(key, digest_size=16, key=self._secret).digest()
+
+    def _checksum(self, data):
+        return blake2b(data, digest_size=_checksum_size, key=self._secret).digest()
+
+    def _offsets(self, key_hash):
+        start = int.from_bytes(key_hash[:8], "big") % self.slots
+
+        for i in range(self.probes):
+            yield _header.size + ((start + i) % self.slots) * self.slot_size
+
+    def _read(self, offset):
+        """Returns ``(key_hash, expires, value_bytes)`` for the slot at
+        ``offset``, or None if it is empty or inconsistent."""
+        data = self._mm[offset : offset + self.slot_size]
+        checksum = data[:_checksum_size]
+
+        if checksum == _empty_checksum:
+            return None
+
+        (key_hash, expires, length) = _slot_header.unpack_from(data, _checksum_size)
+        end = _slot_header_size + length
+
+        if length > self.value_size or checksum != self._checksum(
+            data[_checksum_size:end]
+        ):
+            return None
+
+        return (key_hash, expires, data[_slot_header_size:end])
+
+    def _slot(self, key_hash, expires, value):
+        body = _slot_header.pack(key_hash, expires, len(value)) + value
+        return self._checksum(body) + body
+
+    def get(self, key, default=None):
+        """Return the value for ``key``, or ``default`` if it does not exist
+        or has expired."""
+        key_hash = self._hash(key)
+
+        for offset in self._offsets(key_hash):
+            entry = self._read(offset)
+
+            if entry is not None and entry[0] == key_hash:
+                if entry[1] > self.clock():
+                    self.hits += 1
+                    return json.loads(entry[2].decode("utf-8"))
+                break
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=_marker):
+        """Store ``value`` for ``key``. ``ttl`` overrides the default lifetime
+        for this entry."""
+        if ttl is _marker:
+            ttl = self.ttl
+
+        try:
+            data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            return
+
+        # Values that don't fit in a slot are not cached
+        if len(data) > self.value_size:
+            return
+
+        now = self.clock()
+        expires = float("inf") if ttl is None else now + ttl
+        key_hash = self._hash(key)
+        target = None
+        target_expires = None
+
+        for offset in self._offsets(key_hash):
+            entry = self._read(offset)
+
+            if entry is None or entry[0] == key_hash or entry[1] <= now:
+                target = offset
+                break
+
+            if target is None or entry[1] < target_expires:
+                (target, target_expires) = (offset, entry[1])
+
+        # Remove other copies of the key, they may be found before the new one
+        self._delete(key_hash, skip=target)
+        slot = self._slot(key_hash, expires, data)
+        self._mm[target : target + len(slot)] = slot
+
+    def _delete(self, key_hash, skip=None):
+        found = False
+
+        for offset in self._offsets(key_hash):
+            if offset == skip:
+                continue
+
+            entry = self._read(offset)
+
+            if entry is not None and entry[0] == key_hash:
+                self._mm[offset : offset + _checksum_size] = _empty_checksum
+                found = True
+
+        return found
+
+    def delete(self, key):
+        """Remove ``key``, returns True if it was present."""
+        return self._delete(self._hash(key))
+
+    def clear(self):
+        zero = b"\x00" * self.slot_size
+
+        for i in range(self.slots):
+            offset = _header.size + i * self.slot_size
+            self._mm[offset : offset + self.slot_size] = zero
+
+    def __len__(self):
+        now = self.clock()
+        count = 0
+
+        for i in range(self.slots):
+            entry = self._read(_header.size + i * self.slot_size)
+
+            if entry is not None and entry[1] > now:
+                count += 1
+
+        return count
+
+    def close(self):
+        self._mm.close()
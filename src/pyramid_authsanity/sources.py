@@ -1,11 +1,328 @@
-from webob.cookies import JSONSerializer, SignedCookieProfile, SignedSerializer
+import base64
+import binascii
+import re
+import struct
+
+from pyramid.decorator import reify
+from webob.cookies import CookieProfile, JSONSerializer, SignedSerializer
 from zope.interface import implementer
 
+from .cache import TTLCache
 from .interfaces import IAuthSourceService
 
+_kid_re = re.compile(r"^[A-Za-z0-9_-]+$")
+_marker = object()
+
+_u16 = struct.Struct(">H")
+_i64x2 = struct.Struct(">qq")
+_no_groups = 0xFFFF
+
+
+class CompactSerializer(object):
+    """Serializes the values stored by the authentication policy using a
+    fixed binary layout instead of JSON.
+
+    The first byte is the version of the layout:
+
+    ``0x01``
+        ``[principal, ticket]``
+
+    ``0x02``
+        ``[principal, ticket, issued, expires, groups]``, as stored in
+        stateless mode.
+
+    Followed by the ticket, either as a ``0x00`` byte and the 32 raw bytes of
+    the ticket when it is the URL safe base64 encoding of 32 bytes (as created
+    by the policy), or as a ``0x01`` byte and a length prefixed UTF-8 string.
+    Then the length prefixed UTF-8 principal. Version ``0x02`` continues with
+    ``issued`` and ``expires`` as signed 64 bit integers, and the number of
+    groups (``0xFFFF`` for None) followed by each length prefixed group.
+    Lengths are unsigned 16 bit integers, all integers are big endian.
+
+    Values that do not fit this layout are serialized as JSON, which is also
+    what values that do not start with a known version byte are deserialized
+    as, so switching to this serializer keeps existing values readable.
+    """
+
+    def __init__(self):
+        self.json = JSONSerializer()
+
+    def dumps(self, appstruct):
+        try:
+            return self._dumps(appstruct)
+        except (TypeError, ValueError, UnicodeError, struct.error):
+            return self.json.dumps(appstruct)
+
+    def loads(self, bstruct):
+        if bstruct[:1] not in (b"\x01", b"\x02"):
+            return self.json.loads(bstruct)
+
+        try:
+            (value, offset) = self._loads(bstruct)
+        except (IndexError, UnicodeError, struct.error):
+            raise ValueError("Badly formed compact value")
+
+        if offset != len(bstruct):
+            raise ValueError("Badly formed compact value")
+
+        return value
+
+    def _dumps(self, appstruct):
+        if not isinstance(appstruct, list) or len(appstruct) not in (2, 5):
+            raise TypeError("Unsupported value")
+
+        (principal, ticket) = appstruct[:2]
+        parts = [b"\x01" if len(appstruct) == 2 else b"\x02"]
+
+        raw = _raw_ticket(ticket)
+
+        if raw is not None:
+            parts.append(b"\x00" + raw)
+        else:
+            parts.append(b"\x01" + _string(ticket))
+
+        parts.append(_string(principal))
+
+        if len(appstruct) == 5:
+            (issued, expires, groups) = appstruct[2:]
+
+            if type(issued) is not int or type(expires) is not int:
+                raise TypeError("Unsupported value")
+
+            parts.append(_i64x2.pack(issued, expires))
+
+            if groups is None:
+                parts.append(_u16.pack(_no_groups))
+            else:
+                if len(groups) >= _no_groups:
+                    raise ValueError("Too many groups")
+
+                parts.append(_u16.pack(len(groups)))
+                parts.extend(_string(group) for group in groups)
+
+        return b"".join(parts)
+
+    def _loads(self, bstruct):
+        version = bstruct[0]
+
+        if bstruct[1] == 0:
+            offset = 34
+
+            if len(bstruct) < offset:
+                raise IndexError("Truncated ticket")
+
+            ticket = base64.urlsafe_b64encode(bstruct[2:offset]).rstrip(b"=")
+            ticket = ticket.decode("ascii")
+        elif bstruct[1] == 1:
+            (ticket, offset) = _read_string(bstruct, 2)
+        else:
+            raise IndexError("Unknown ticket encoding")
+
+        (principal, offset) = _read_string(bstruct, offset)
+        value = [principal, ticket]
+
+        if version == 2:
+            (issued, expires) = _i64x2.unpack_from(bstruct, offset)
+            offset += _i64x2.size
+            (count,) = _u16.unpack_from(bstruct, offset)
+            offset += _u16.size
+            groups = None
+
+            if count != _no_groups:
+                groups = []
+
+                for _ in range(count):
+                    (group, offset) = _read_string(bstruct, offset)
+                    groups.append(group)
+
+            value.extend([issued, expires, groups])
+
+        return (value, offset)
+
+
+def _raw_ticket(ticket):
+    """Returns the 32 bytes encoded by ``ticket``, or None if it isn't the
+    unpadded URL safe base64 encoding of 32 bytes."""
+    if not isinstance(ticket, str) or len(ticket) != 43:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(ticket + "=")
+    except (binascii.Error, ValueError):
+        return None
+
+    # Only use the raw bytes if they round trip to the exact same string
+    if base64.urlsafe_b64encode(raw).rstrip(b"=") != ticket.encode("ascii"):
+        return None
+
+    return raw
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise TypeError("Unsupported value")
+
+    data = value.encode("utf-8")
+    return _u16.pack(len(data)) + data
+
+
+def _read_string(bstruct, offset):
+    (length,) = _u16.unpack_from(bstruct, offset)
+    offset += _u16.size
+    end = offset + length
+
+    if end > len(bstruct):
+        raise IndexError("Truncated string")
+
+    return (bstruct[offset:end].decode("utf-8"), end)
+
+
+_encodings = {
+    "json": JSONSerializer,
+    "compact": CompactSerializer,
+}
+
+
+def _encoding(name):
+    try:
+        return _encodings[name]()
+    except KeyError:
+        raise ValueError("Unknown encoding: %r" % (name,))
+
+
+class KeyringSerializer(object):
+    """A signed serializer that supports multiple secrets.
+
+    ``keyring`` is a mapping (or a list of pairs) of key id to secret, the
+    first key is the current key and is used to sign new values. Signed values
+    are prefixed with the id of the key that signed them, followed by a
+    ``.``, so verifying a value is a single dictionary lookup for the signer
+    no matter how many keys there are. Key ids may only contain ASCII letters,
+    digits, ``-`` and ``_``.
+
+    Values without a key id were signed using a single ``secret``, pass that
+    ``secret`` to keep accepting them while migrating to a keyring.
+
+    To rotate keys, add the new key at the front of the keyring, and remove
+    the old key once the values signed with it are no longer needed.
+    """
+
+    def __init__(self, keyring, salt, hashalg="sha512", serializer=None, secret=None):
+        if hasattr(keyring, "items"):
+            keyring = keyring.items()
+
+        keyring = list(keyring)
+
+        if not keyring:
+            raise ValueError("keyring must contain at least one key")
+
+        self.signers = {}
+
+        for (kid, key) in keyring:
+            if not _kid_re.match(kid):
+                raise ValueError("Invalid key id: %r" % (kid,))
+
+            bkid = kid.encode("ascii")
+
+            if bkid in self.signers:
+                raise ValueError("Duplicate key id: %r" % (kid,))
+
+            self.signers[bkid] = SignedSerializer(
+                key, salt, hashalg, serializer=serializer
+            )
+
+        self.kid = keyring[0][0].encode("ascii")
+        self.signer = self.signers[self.kid]
+        self.legacy = None
+
+        if secret is not None:
+            self.legacy = SignedSerializer(secret, salt, hashalg, serializer=serializer)
+
+    @property
+    def hashalg(self):
+        return self.signer.hashalg
+
+    def dumps(self, appstruct):
+        """Serialize and sign ``appstruct`` using the current key."""
+        return self.kid + b"." + self.signer.dumps(appstruct)
+
+    def loads(self, bstruct):
+        """Verify the signature using the key named in ``bstruct`` and
+        deserialize it, raises ``ValueError`` if the key is unknown or the
+        signature is invalid."""
+        if not isinstance(bstruct, bytes):
+            bstruct = bstruct.encode("latin-1")
+
+        (kid, sep, signed) = bstruct.partition(b".")
+
+        if not sep:
+            if self.legacy is None:
+                raise ValueError("No key id")
+
+            return self.legacy.loads(bstruct)
+
+        signer = self.signers.get(kid)
+
+        if signer is None:
+            raise ValueError("Unknown key id")
+
+        return signer.loads(signed)
+
+
+class CachingSerializer(object):
+    """Wraps a signed ``serializer`` and caches the results of ``loads``,
+    keyed by the signed value.
+
+    The same cookie or token is usually sent with many requests, a cache hit
+    skips decoding, verifying the signature and deserializing it. Only values
+    that were successfully verified are cached, the key is the complete signed
+    value so a cached result is only ever returned for the exact value that
+    was verified. ``cache`` is a :class:`pyramid_authsanity.cache.TTLCache`
+    (or an object with the same ``get`` and ``set`` methods), its ``hits``
+    and ``misses`` tell how well it works.
+    """
+
+    def __init__(self, serializer, cache):
+        self.serializer = serializer
+        self.cache = cache
+
+    def dumps(self, appstruct):
+        return self.serializer.dumps(appstruct)
+
+    def loads(self, bstruct):
+        value = self.cache.get(bstruct, _marker)
+
+        if value is _marker:
+            value = self.serializer.loads(bstruct)
+            self.cache.set(bstruct, value)
+
+        # Callers get their own copy of the cached list
+        return list(value) if isinstance(value, list) else value
+
+
+def _signed_serializer(secret, keyring, salt, hashalg, serializer=None, cache_size=0):
+    if keyring:
+        signed = KeyringSerializer(
+            keyring, salt, hashalg, serializer=serializer, secret=secret
+        )
+    elif secret is None:
+        raise ValueError("Either secret or keyring is required")
+    else:
+        signed = SignedSerializer(secret, salt, hashalg, serializer=serializer)
+
+    if cache_size:
+        signed = CachingSerializer(signed, TTLCache(max_size=cache_size))
+
+    return signed
+
 
 def SessionAuthSourceInitializer(value_key="sanity."):
-    """An authentication source that uses the current session"""
+    """An authentication source that uses the current session.
+
+    The session is only accessed when the value is read or changed, and the
+    value is not written to the session if it is unchanged, so requests that
+    don't need it don't load (or create) a session.
+    """
 
     value_key = value_key + "value"
 
@@ -15,9 +332,12 @@ def SessionAuthSourceInitializer(value_key="sanity."):
 
         def __init__(self, context, request):
             self.request = request
-            self.session = request.session
             self.cur_val = None
 
+        @reify
+        def session(self):
+            return self.request.session
+
         def get_value(self):
             if self.cur_val is None:
                 self.cur_val = self.session.get(value_key, [None, None])
@@ -28,7 +348,8 @@ def SessionAuthSourceInitializer(value_key="sanity."):
             if self.cur_val is None:
                 self.cur_val = self.session.get(value_key, [None, None])
 
-            self.session[value_key] = value
+            if self.session.get(value_key) != value:
+                self.session[value_key] = value
             return []
 
         def headers_forget(self):
@@ -43,7 +364,7 @@ def SessionAuthSourceInitializer(value_key="sanity."):
 
 
 def CookieAuthSourceInitializer(
-    secret,
+    secret=None,
     cookie_name="auth",
     secure=False,
     max_age=None,
@@ -52,8 +373,45 @@ def CookieAuthSourceInitializer(
     domains=None,
     debug=False,
     hashalg="sha512",
+    keyring=None,
+    encoding="json",
+    cache_size=0,
 ):
-    """An authentication source that uses a unique cookie."""
+    """An authentication source that uses a unique cookie.
+
+    The cookie is signed using ``secret``, or if a ``keyring`` is given using
+    a :class:`KeyringSerializer`, in which case cookies signed with ``secret``
+    are still accepted.
+
+    ``encoding`` is either ``json`` or ``compact``, see
+    :class:`CompactSerializer`. If ``cache_size`` is not 0, up to that many
+    verified cookies are cached, see :class:`CachingSerializer`. The cache is
+    available as the ``cache`` attribute of the returned class (None when
+    caching is disabled).
+    """
+
+    serializer = _signed_serializer(
+        secret,
+        keyring,
+        "authsanity",
+        hashalg,
+        serializer=_encoding(encoding),
+        cache_size=cache_size,
+    )
+
+    # Setting up the signer (salting the secret, picking the digest) is the
+    # expensive part of a cookie profile, so it is done once here and the
+    # profile is only bound to each request. This is equivalent to
+    # webob.cookies.SignedCookieProfile, whose bind() re-creates the signer.
+    profile = CookieProfile(
+        cookie_name,
+        secure=secure,
+        max_age=max_age,
+        httponly=httponly,
+        path=path,
+        domains=domains,
+        serializer=serializer,
+    )
 
     @implementer(IAuthSourceService)
     class CookieAuthSource(object):
@@ -66,19 +424,8 @@ def CookieAuthSourceInitializer(
                 self.domains = []
                 self.domains.append(request.domain)
 
-            self.cookie = SignedCookieProfile(
-                secret,
-                "authsanity",
-                cookie_name,
-                secure=secure,
-                max_age=max_age,
-                httponly=httponly,
-                path=path,
-                domains=domains,
-                hashalg=hashalg,
-            )
             # Bind the cookie to the current request
-            self.cookie = self.cookie.bind(request)
+            self.cookie = profile.bind(request)
 
         def get_value(self):
             val = self.cookie.get_value()
@@ -94,11 +441,42 @@ def CookieAuthSourceInitializer(
         def headers_forget(self):
             return self.cookie.get_headers(None, max_age=0)
 
+    CookieAuthSource.cache = getattr(serializer, "cache", None)
+
     return CookieAuthSource
 
 
-def HeaderAuthSourceInitializer(secret, salt="sanity.header."):
-    """An authentication source that uses the Authorization header."""
+def HeaderAuthSourceInitializer(
+    secret=None,
+    salt="sanity.header.",
+    hashalg="sha512",
+    keyring=None,
+    encoding="json",
+    cache_size=0,
+):
+    """An authentication source that uses the Authorization header.
+
+    The token is signed using ``secret``, or if a ``keyring`` is given using
+    a :class:`KeyringSerializer`, in which case tokens signed with ``secret``
+    are still accepted.
+
+    ``encoding`` is either ``json`` or ``compact``, see
+    :class:`CompactSerializer`. If ``cache_size`` is not 0, up to that many
+    verified tokens are cached, see :class:`CachingSerializer`. The cache is
+    available as the ``cache`` attribute of the returned class (None when
+    caching is disabled).
+    """
+
+    # The serializer holds no per-call state, so a single instance is safe
+    # to share between all requests/threads.
+    serializer = _signed_serializer(
+        secret,
+        keyring,
+        salt,
+        hashalg,
+        serializer=_encoding(encoding),
+        cache_size=cache_size,
+    )
 
     @implementer(IAuthSourceService)
     class HeaderAuthSource(object):
@@ -107,13 +485,7 @@ def HeaderAuthSourceInitializer(secret, salt="sanity.header."):
         def __init__(self, context, request):
             self.request = request
             self.cur_val = None
-
-            serializer = JSONSerializer()
-            self.serializer = SignedSerializer(
-                secret,
-                salt,
-                serializer=serializer,
-            )
+            self.serializer = serializer
 
         def _get_authorization(self):
             try:
@@ -149,4 +521,91 @@ def HeaderAuthSourceInitializer(secret, salt="sanity.header."):
 
             return []
 
+    HeaderAuthSource.cache = getattr(serializer, "cache", None)
+
     return HeaderAuthSource
+
+
+def CompositeAuthSourceInitializer(sources, remember_source=0):
+    """An authentication source that chains other authentication sources.
+
+    ``sources`` is a list of authentication source factories, which should be
+    ordered from cheapest to most expensive to read. The value is read from
+    each source in turn, stopping at the first one that provides a principal
+    or a ticket. Sources that come after it are not created, and only the
+    sources that were consulted contribute to ``vary``.
+
+    ``headers_remember`` and ``headers_forget`` use the source that provided
+    the current value. When no source provided a value, a new value is
+    remembered using the source at index ``remember_source`` and there is
+    nothing to forget.
+    """
+
+    sources = list(sources)
+
+    if not sources:
+        raise ValueError("At least one source is required")
+
+    # Normalizes negative indexes, and fails early on an invalid one
+    remember_source = range(len(sources))[remember_source]
+
+    @implementer(IAuthSourceService)
+    class CompositeAuthSource(object):
+        def __init__(self, context, request):
+            self.context = context
+            self.request = request
+            self.cur_val = None
+            self.active = None
+            self._consulted = []
+
+        @property
+        def vary(self):
+            vary = []
+
+            for source in self._consulted:
+                for header in source.vary:
+                    if header not in vary:
+                        vary.append(header)
+
+            return vary
+
+        def _source(self, index):
+            while len(self._consulted) <= index:
+                factory = sources[len(self._consulted)]
+                self._consulted.append(factory(self.context, self.request))
+
+            return self._consulted[index]
+
+        def get_value(self):
+            if self.cur_val is None:
+                self.cur_val = [None, None]
+
+                for index in range(len(sources)):
+                    source = self._source(index)
+                    value = source.get_value()
+
+                    if value[0] is not None or value[1] is not None:
+                        self.cur_val = value
+                        self.active = source
+                        break
+
+            return self.cur_val
+
+        def headers_remember(self, value):
+            self.get_value()
+            source = self.active
+
+            if source is None:
+                source = self._source(remember_source)
+
+            return source.headers_remember(value)
+
+        def headers_forget(self):
+            self.get_value()
+
+            if self.active is None:
+                return []
+
+            return self.active.headers_forget()
+
+    return CompositeAuthSource
@@ -0,0 +1,236 @@
+from contextlib import contextmanager
+import queue
+import re
+import time
+
+from zope.interface import implementer
+
+from .interfaces import IAuthService
+
+_marker = object()
+
+
+class ConnectionPool(object):
+    """A small thread safe pool of DB-API connections.
+
+    ``connect`` is a callable with no arguments that returns a new connection.
+    At most ``size`` idle connections are kept, connections are created on
+    demand when the pool is empty. A connection that raised an error is closed
+    instead of being returned to the pool.
+    """
+
+    def __init__(self, connect, size=5):
+        self.connect = connect
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.close()
+            except Exception:  # pragma: no cover
+                pass
+            raise
+        else:
+            self.release(conn)
+
+
+_param_re = re.compile(r"\{(\w+)\}")
+
+
+class Query(object):
+    """A SQL statement that is rendered once for the driver's ``paramstyle``.
+
+    Placeholders are written as ``{name}``. Because the statement text is
+    built once and then reused verbatim, drivers that cache prepared
+    statements (sqlite3, psycopg, ...) only
+    have to prepare it once per connection.
+    """
+
+    def __init__(self, sql, paramstyle="qmark"):
+        self.names = _param_re.findall(sql)
+        self.paramstyle = paramstyle
+        self.named = paramstyle in ("named", "pyformat")
+        counter = iter(range(1, len(self.names) + 1))
+
+        def replace(match):
+            name = match.group(1)
+
+            if paramstyle == "qmark":
+                return "?"
+            if paramstyle == "format":
+                return "%s"
+            if paramstyle == "numeric":
+                return ":%d" % (next(counter),)
+            if paramstyle == "named":
+                return ":" + name
+            if paramstyle == "pyformat":
+                return "%(" + name + ")s"
+            raise ValueError("Unsupported paramstyle: %r" % (paramstyle,))
+
+        self.sql = _param_re.sub(replace, sql)
+
+    def params(self, **values):
+        if self.named:
+            return values
+
+        return tuple(values[name] for name in self.names)
+
+
+def SQLAuthServiceInitializer(
+    connect=None,
+    paramstyle="qmark",
+    pool_size=5,
+    ttl=None,
+    tickets_table="authsanity_tickets",
+    groups_table="authsanity_groups",
+    pool=None,
+):
+    """An authentication service that stores tickets in a SQL database using
+    any DB-API 2.0 driver.
+
+    ``connect`` is a callable returning a new connection, connections are kept
+    in a :class:`ConnectionPool` of ``pool_size`` connections, they must be
+    usable from any thread (for :mod:`sqlite3` pass
+    ``check_same_thread=False``). ``paramstyle`` is the ``paramstyle`` of the
+    driver's module. ``ttl`` is the number of seconds a new ticket is valid,
+    ``None`` means tickets do not expire.
+
+    The following tables are expected to exist::
+
+        CREATE TABLE authsanity_tickets (
+            ticket VARCHAR(64) PRIMARY KEY,
+            principal VARCHAR(255) NOT NULL,
+            expires DOUBLE PRECISION NULL
+        );
+
+        CREATE TABLE authsanity_groups (
+            principal VARCHAR(255) NOT NULL,
+            name VARCHAR(255) NOT NULL
+        );
+
+    The ticket and the user's groups are fetched with a single query when the
+    ticket is verified, so a request costs one round trip to the database.
+    """
+
+    if pool is None:
+        if connect is None:
+            raise ValueError("Either connect or pool is required")
+
+        pool = ConnectionPool(connect, size=pool_size)
+
+    verify_query = Query(
+        "SELECT t.principal, g.name FROM {tickets} t "
+        "LEFT JOIN {groups} g ON g.principal = t.principal "
+        "WHERE t.ticket = {{ticket}} AND t.principal = {{principal}} "
+        "AND (t.expires IS NULL OR t.expires > {{now}})".format(
+            tickets=tickets_table, groups=groups_table
+        ),
+        paramstyle,
+    )
+    add_query = Query(
+        "INSERT INTO {tickets} (ticket, principal, expires) "
+        "VALUES ({{ticket}}, {{principal}}, {{expires}})".format(tickets=tickets_table),
+        paramstyle,
+    )
+    extend_query = Query(
+        "UPDATE {tickets} SET expires = {{expires}} "
+        "WHERE ticket = {{ticket}} AND principal = {{principal}}".format(
+            tickets=tickets_table
+        ),
+        paramstyle,
+    )
+    remove_query = Query(
+        "DELETE FROM {tickets} WHERE ticket = {{ticket}}".format(tickets=tickets_table),
+        paramstyle,
+    )
+
+    def execute(query, fetch=False, **values):
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                cursor.execute(query.sql, query.params(**values))
+
+                if fetch:
+                    result = cursor.fetchall()
+                    # End the transaction the driver may have opened, so
+                    # the pooled connection holds no locks or snapshot
+                    conn.rollback()
+                else:
+                    result = cursor.rowcount
+                    conn.commit()
+            finally:
+                cursor.close()
+
+        return result
+
+    @implementer(IAuthService)
+    class SQLAuthService(object):
+        def __init__(self, context, request):
+            self._userid = _marker
+            self._groups = []
+
+        def userid(self):
+            if self._userid is _marker:
+                raise ValueError("No ticket has been verified")
+
+            return self._userid
+
+        def groups(self):
+            return list(self._groups)
+
+        def verify_ticket(self, principal, ticket):
+            self._userid = None
+            self._groups = []
+
+            if principal is None or ticket is None:
+                return
+
+            rows = execute(
+                verify_query,
+                fetch=True,
+                ticket=ticket,
+                principal=principal,
+                now=time.time(),
+            )
+
+            if rows:
+                self._userid = principal
+                self._groups = [name for (_, name) in rows if name is not None]
+
+        def add_ticket(self, principal, ticket):
+            expires = None if ttl is None else time.time() + ttl
+            execute(add_query, ticket=ticket, principal=principal, expires=expires)
+
+        def extend_ticket(self, principal, ticket):
+            if ttl is not None:
+                execute(
+                    extend_query,
+                    ticket=ticket,
+                    principal=principal,
+                    expires=time.time() + ttl,
+                )
+
+        def remove_ticket(self, ticket):
+            return execute(remove_query, ticket=ticket) > 0
+
+    SQLAuthService.pool = pool
+
+    return SQLAuthService
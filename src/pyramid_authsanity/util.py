@@ -7,6 +7,42 @@ def int_or_none(x):
     return int(x) if x is not None else x
 
 
+def float_or_none(x):
+    return float(x) if x is not None else x
+
+
+def keyring_from_settings(value):
+    """Parses a whitespace separated list of ``kid:secret`` pairs into a list
+    of ``(kid, secret)`` tuples, the first pair being the current key. A
+    mapping of key id to secret, or a list of pairs, is also accepted."""
+    if not isinstance(value, str):
+        if hasattr(value, "items"):
+            return list(value.items())
+
+        keyring = []
+
+        for entry in value:
+            # A string would be split into characters
+            if isinstance(entry, (str, bytes)) or len(entry) != 2:
+                raise ValueError("Invalid keyring entry, expected a (kid, secret) pair")
+
+            keyring.append(tuple(entry))
+
+        return keyring
+
+    keyring = []
+
+    for entry in value.split():
+        (kid, sep, secret) = entry.partition(":")
+
+        if not sep or not kid or not secret:
+            raise ValueError("Invalid keyring entry, expected kid:secret")
+
+        keyring.append((kid, secret))
+
+    return keyring
+
+
 def kw_from_settings(settings, from_prefix="authsanity."):
     return {
         k.replace(from_prefix, ""): v
@@ -15,20 +51,63 @@ def kw_from_settings(settings, from_prefix="authsanity."):
     }
 
 
+_vary_callbacks = {}
+
+
 def add_vary_callback(vary_by):
+    """Returns a response callback that adds the headers in ``vary_by`` to the
+    Vary header of the response.
+
+    The callback is created once for every distinct set of headers (in
+    practice, once per source class) and then shared, the headers are turned
+    into a frozenset up front so that each response only does a subset check.
+    """
+    key = tuple(vary_by)
+
+    try:
+        return _vary_callbacks[key]
+    except KeyError:
+        pass
+
+    vary_set = frozenset(key)
+
     def vary_add(request, response):
-        vary = set(response.vary if response.vary is not None else [])
-        vary |= set(vary_by)
-        response.vary = list(vary)
+        vary = response.vary
+
+        if vary is None:
+            response.vary = list(vary_set)
+        elif not vary_set.issubset(vary):
+            response.vary = list(vary_set.union(vary))
 
+    _vary_callbacks[key] = vary_add
     return vary_add
 
 
 def _find_services(request):
+    """Returns the ``(sourcesvc, authsvc)`` pair for this request, looked up
+    once and then kept in the request cache."""
+    cache = _request_cache(request)
+
+    try:
+        return cache["services"]
+    except KeyError:
+        pass
+
     sourcesvc = request.find_service(IAuthSourceService)
     authsvc = request.find_service(IAuthService)
 
-    return (sourcesvc, authsvc)
+    services = cache["services"] = (sourcesvc, authsvc)
+    return services
+
+
+def _request_cache(request):
+    """Returns the dictionary used to memoize authentication results for the
+    lifetime of this request."""
+    try:
+        return request._authsanity_cache
+    except AttributeError:
+        cache = request._authsanity_cache = {}
+        return cache
 
 
 def _session_registered(request):
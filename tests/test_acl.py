@@ -0,0 +1,217 @@
+import random
+
+from pyramid.authorization import (
+    ALL_PERMISSIONS,
+    DENY_ALL,
+    ACLHelper,
+    Allow,
+    Authenticated,
+    Deny,
+    Everyone,
+)
+
+from pyramid_authsanity.acl import CompiledACL, CompiledACLHelper
+
+
+class TestCompiledACL(object):
+    def test_first_match_wins(self):
+        acl = [
+            (Allow, "a", "view"),
+            (Deny, "b", "view"),
+            (Deny, "a", "view"),
+        ]
+        compiled = CompiledACL(acl)
+
+        assert compiled.match(frozenset(["a", "b"]), "view") is acl[0]
+        assert compiled.match(frozenset(["b"]), "view") is acl[1]
+        assert compiled.match(frozenset(["c"]), "view") is None
+
+    def test_permission_sequence(self):
+        acl = [(Allow, "a", ("view", "edit"))]
+        compiled = CompiledACL(acl)
+
+        assert compiled.match(frozenset(["a"]), "edit") is acl[0]
+        assert compiled.match(frozenset(["a"]), "delete") is None
+
+    def test_all_permissions(self):
+        acl = [(Allow, "a", "view"), DENY_ALL]
+        compiled = CompiledACL(acl)
+
+        assert compiled.match(frozenset(["a", Everyone]), "view") is acl[0]
+        assert compiled.match(frozenset(["a", Everyone]), "edit") is DENY_ALL
+
+    def test_many_principals_small_table(self):
+        acl = [(Allow, "a", "view"), (Deny, "b", "view")]
+        compiled = CompiledACL(acl)
+        principals = frozenset(["b", "a"] + ["group:%d" % i for i in range(10)])
+
+        assert compiled.match(principals, "view") is acl[0]
+
+
+class TestCompiledACLHelper(object):
+    def _makeOne(self):
+        return CompiledACLHelper()
+
+    def test_no_acl(self):
+        helper = self._makeOne()
+        result = helper.permits(DummyContext(), frozenset([Everyone]), "view")
+
+        assert not result
+        assert result.ace == "<default deny>"
+
+    def test_allowed(self):
+        acl = [(Allow, Everyone, "view")]
+        context = DummyContext(acl=acl)
+        result = self._makeOne().permits(context, frozenset([Everyone]), "view")
+
+        assert result
+        assert result.ace is acl[0]
+        assert result.acl is acl
+        assert result.context is context
+
+    def test_denied(self):
+        acl = [(Deny, Everyone, "view")]
+        context = DummyContext(acl=acl)
+        result = self._makeOne().permits(context, frozenset([Everyone]), "view")
+
+        assert not result
+        assert result.ace is acl[0]
+
+    def test_lineage(self):
+        root = DummyContext(acl=[(Allow, Authenticated, "view")])
+        middle = DummyContext(parent=root)
+        leaf = DummyContext(acl=[(Deny, "bob", "edit")], parent=middle)
+        helper = self._makeOne()
+
+        principals = frozenset([Everyone, Authenticated, "bob"])
+        assert helper.permits(leaf, principals, "view")
+        assert not helper.permits(leaf, principals, "edit")
+        assert not helper.permits(leaf, frozenset([Everyone]), "view")
+
+    def test_empty_acl(self):
+        root = DummyContext(acl=[(Allow, Everyone, "view")])
+        leaf = DummyContext(acl=[], parent=root)
+
+        assert self._makeOne().permits(leaf, frozenset([Everyone]), "view")
+
+    def test_callable_acl(self):
+        calls = []
+
+        def acl():
+            calls.append(1)
+            return [(Allow, Everyone, "view")]
+
+        context = DummyContext(acl=acl)
+        helper = self._makeOne()
+
+        assert helper.permits(context, frozenset([Everyone]), "view")
+        assert helper.permits(context, frozenset([Everyone]), "view")
+        assert len(calls) == 2
+
+    def test_compiled_cached(self):
+        acl = [(Allow, Everyone, "view")]
+        helper = self._makeOne()
+
+        assert helper.compile(acl) is helper.compile(acl)
+
+    def test_modified_acl_recompiled(self):
+        acl = [(Allow, Everyone, "view")]
+        context = DummyContext(acl=acl)
+        helper = self._makeOne()
+
+        assert not helper.permits(context, frozenset([Everyone]), "edit")
+
+        acl.insert(0, (Allow, Everyone, ALL_PERMISSIONS))
+
+        assert helper.permits(context, frozenset([Everyone]), "edit")
+
+    def test_replaced_ace_recompiled(self):
+        acl = [(Allow, Everyone, "view")]
+        context = DummyContext(acl=acl)
+        helper = self._makeOne()
+
+        assert helper.permits(context, frozenset([Everyone]), "view")
+
+        acl[0] = (Deny, Everyone, "view")
+
+        assert not helper.permits(context, frozenset([Everyone]), "view")
+
+    def test_is_current(self):
+        acl = [(Allow, Everyone, "view")]
+        compiled = CompiledACL(acl)
+
+        assert compiled.is_current(acl)
+        assert not compiled.is_current(list(acl))
+
+    def test_tuple_acl_not_copied(self):
+        acl = ((Allow, Everyone, "view"),)
+        helper = self._makeOne()
+        compiled = helper.compile(acl)
+
+        assert compiled.snapshot is None
+        assert helper.compile(acl) is compiled
+
+    def test_sequence_acl(self):
+        class ACL(object):
+            def __init__(self, aces):
+                self.aces = aces
+
+            def __iter__(self):
+                return iter(self.aces)
+
+            def __len__(self):
+                return len(self.aces)
+
+        acl = ACL([(Allow, Everyone, "view")])
+        context = DummyContext(acl=acl)
+        helper = self._makeOne()
+
+        assert helper.permits(context, frozenset([Everyone]), "view")
+
+        acl.aces[0] = (Deny, Everyone, "view")
+
+        assert not helper.permits(context, frozenset([Everyone]), "view")
+
+    def test_same_as_acl_helper(self):
+        rnd = random.Random(42)
+        principals = ["p%d" % i for i in range(20)] + [Everyone, Authenticated]
+        permissions = ["view", "edit", "delete", "admin"]
+        compiled = self._makeOne()
+        reference = ACLHelper()
+
+        def random_acl():
+            acl = []
+
+            for _ in range(rnd.randint(0, 30)):
+                perms = rnd.choice(
+                    [
+                        rnd.choice(permissions),
+                        tuple(rnd.sample(permissions, 2)),
+                        ALL_PERMISSIONS,
+                    ]
+                )
+                action = rnd.choice([Allow, Deny])
+                acl.append((action, rnd.choice(principals), perms))
+
+            return acl
+
+        for _ in range(200):
+            root = DummyContext(acl=random_acl())
+            leaf = DummyContext(acl=random_acl(), parent=root)
+            user = frozenset(rnd.sample(principals, rnd.randint(1, 10)))
+
+            for permission in permissions:
+                expected = reference.permits(leaf, user, permission)
+                result = compiled.permits(leaf, user, permission)
+
+                assert bool(result) == bool(expected)
+                assert result.ace == expected.ace
+                assert result.context is expected.context
+
+
+class DummyContext(object):
+    def __init__(self, acl=None, parent=None):
+        if acl is not None:
+            self.__acl__ = acl
+
+        self.__parent__ = parent
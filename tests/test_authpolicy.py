@@ -50,7 +50,7 @@ class TestAuthServicePolicy(object):
 
         request.addfinalizer(finish)
 
-    def _makeOne(self, debug=False, source=None, auth=None):
+    def _makeOne(self, debug=False, source=None, auth=None, **kw):
         from pyramid_authsanity import AuthServicePolicy
 
         def find_services(request):
@@ -59,7 +59,7 @@ class TestAuthServicePolicy(object):
         def session_registered(request):
             return False
 
-        policy = AuthServicePolicy(debug=debug)
+        policy = AuthServicePolicy(debug=debug, **kw)
         policy._find_services = find_services
         policy._session_registered = session_registered
         return policy
@@ -127,11 +127,36 @@ class TestAuthServicePolicy(object):
 
         auth = BadAuth()
 
-        policy = self._makeOne(source=source, auth=auth)
+        policy = self._makeOne(source=source, auth=auth, anonymous_fast_path=False)
 
         authuserid = policy.authenticated_userid(request)
         assert authuserid is None
 
+    def test_anonymous_fast_path(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+
+        class UntouchedAuth(object):
+            def __getattr__(self, name):
+                pytest.fail("auth service used: %s" % (name,))  # pragma: no cover
+
+        policy = self._makeOne(debug=True, source=source, auth=UntouchedAuth())
+
+        assert policy.authenticated_userid(request) is None
+        assert policy.effective_principals(request) == ["system.Everyone"]
+
+    def test_anonymous_fast_path_disabled(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init()(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, anonymous_fast_path=False)
+
+        assert policy.authenticated_userid(request) is None
+        assert auth.authcomplete is True
+
     def test_no_user_effective_principals(self):
         from pyramid.authorization import Everyone
 
@@ -193,6 +218,44 @@ class TestAuthServicePolicy(object):
         assert isinstance(source.value, list)
         assert len(source.value) == 2
 
+    def test_unconfigured_policy_not_modified(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(debug=True, source=source, auth=auth)
+        before = dict(vars(policy))
+        policy.remember(request, "test")
+        policy.forget(request)
+
+        assert vars(policy) == before
+
+    def test_configured_logger(self):
+        request = self._makeOneRequest()
+        logger = DummyLogger()
+        policy = self._makeOne(debug=True)
+        policy._logger = logger
+
+        policy._log("message", "test", request)
+
+        assert len(logger.logentries) == 1
+        assert self.logger.logentries == []
+
+    def test_remember_without_session_skips_userid(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test")(context, request)
+        auth.verify_ticket = pytest.fail
+
+        policy = self._makeOne(source=source, auth=auth)
+        policy.remember(request, "test")
+
+        assert source.value[0] == "test"
+
     def test_forget(self):
         context = None
         request = self._makeOneRequest()
@@ -210,6 +273,508 @@ class TestAuthServicePolicy(object):
         assert len(headers) == 0
         assert "valid" not in auth.valid_tickets
 
+    def test_authenticated_userid_memoized(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.authenticated_userid(request) == "test"
+
+        auth._userid = "other"
+
+        assert policy.authenticated_userid(request) == "test"
+
+    def test_effective_principals_memoized(self):
+        from pyramid.authorization import Authenticated, Everyone
+
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )(context, request)
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        groups = policy.effective_principals(request)
+        groups.append("modified")
+        auth._groups = ["other"]
+
+        assert [Everyone, Authenticated, "test", "group"] == (
+            policy.effective_principals(request)
+        )
+
+    def test_no_user_effective_principals_memoized(self):
+        from pyramid.authorization import Everyone
+
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init()(context, request)
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        policy.effective_principals(request).append("modified")
+
+        assert [Everyone] == policy.effective_principals(request)
+
+    def test_remember_invalidates_memoized(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init(fake_userid="test")(context, request)
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.authenticated_userid(request) is None
+
+        policy.remember(request, "test")
+        auth.verify_ticket(*source.value)
+
+        assert policy.authenticated_userid(request) == "test"
+
+    def test_forget_invalidates_memoized(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.authenticated_userid(request) == "test"
+
+        policy.forget(request)
+        auth.ticketvalid = False
+
+        assert policy.authenticated_userid(request) is None
+
+    def test_vary_callback_added_once(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        policy.authenticated_userid(request)
+        policy.effective_principals(request)
+        policy.remember(request, "test")
+        policy.authenticated_userid(request)
+        policy.forget(request)
+
+        assert len(request.callbacks) == 1
+
+    def test_vary_read_at_response_time(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth)
+        policy.authenticated_userid(request)
+        source.vary = ["Authorization"]
+
+        response = pyramid.testing.DummyRequest().response
+        for callback in request.callbacks:
+            callback(request, response)
+
+        assert response.vary == ("Authorization",)
+
+    def test_effective_principals_groups_cache(self):
+        from pyramid.authorization import Authenticated, Everyone
+
+        from pyramid_authsanity.cache import GroupsCache
+
+        groups_cache = GroupsCache()
+        policy = self._makeOne(groups_cache=groups_cache)
+        auth_factory = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )
+
+        def principals():
+            request = self._makeOneRequest()
+            source = fake_source_init(["test", "valid"])(None, request)
+            auth = auth_factory(None, request)
+            policy._find_services = lambda request: (source, auth)
+            return policy.effective_principals(request)
+
+        assert [Everyone, Authenticated, "test", "group"] == principals()
+
+        # The groups changed, but the cached groups are used
+        auth_factory.groups = lambda self: ["other"]
+        assert [Everyone, Authenticated, "test", "group"] == principals()
+
+        groups_cache.invalidate()
+        assert [Everyone, Authenticated, "test", "other"] == principals()
+
+    def test_remember_stateless(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init(fake_userid="test")(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=300)
+
+        before = int(time.time())
+        policy.remember(request, "test", groups=("group",))
+
+        (principal, ticket, issued, expires, groups) = source.value
+        assert principal == "test"
+        assert ticket in auth.valid_tickets
+        assert before <= issued <= time.time()
+        assert expires == issued + 300
+        assert groups == ["group"]
+
+    def test_remember_stateless_no_groups(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init(fake_userid="test")(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=300)
+        policy.remember(request, "test")
+
+        assert len(source.value) == 5
+        assert source.value[4] is None
+
+    def test_stateless_ticket_skips_auth_service(self):
+        import time
+
+        from pyramid.authorization import Authenticated, Everyone
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "stale", now, now + 60, ["group"]])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=[])(context, request)
+        auth.verify_ticket = pytest.fail
+
+        policy = self._makeOne(debug=True, source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert [Everyone, Authenticated, "test", "group"] == (
+            policy.effective_principals(request)
+        )
+
+    def test_stateless_ticket_without_groups(self):
+        import time
+
+        from pyramid.authorization import Authenticated, Everyone
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now, now + 60, None])(
+            context, request
+        )
+        auth = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert auth.authcomplete is False
+
+        assert [Everyone, Authenticated, "test", "group"] == (
+            policy.effective_principals(request)
+        )
+        assert auth.authcomplete is True
+
+    def test_stateless_ticket_without_groups_groups_cache(self):
+        import time
+
+        from pyramid_authsanity.cache import GroupsCache
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now, now + 60, None])(
+            context, request
+        )
+        auth = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )(context, request)
+        groups_cache = GroupsCache()
+        groups_cache.set("test", ["cached"])
+
+        policy = self._makeOne(
+            source=source, auth=auth, stateless_ttl=60, groups_cache=groups_cache
+        )
+
+        assert "cached" in policy.effective_principals(request)
+        assert auth.authcomplete is False
+
+    def test_stateless_ticket_expired(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now - 120, now - 60, ["admin"]])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert auth.authcomplete is True
+        assert "admin" not in policy.effective_principals(request)
+
+    def test_stateless_ticket_expired_reissued(self):
+        import time
+
+        from pyramid.authorization import Authenticated, Everyone
+
+        now = int(time.time())
+        value = ["test", "valid", now - 120, now - 60, ["admin"]]
+        auth_factory = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )
+        policy = self._makeOne(stateless_ttl=60)
+
+        request = self._makeOneRequest()
+        source = fake_source_init(value)(None, request)
+        auth = auth_factory(None, request)
+        policy._find_services = lambda request: (source, auth)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert auth.authcomplete is True
+
+        self._respond(request)
+        (principal, ticket, issued, expires, groups) = source.value
+
+        assert (principal, ticket, groups) == ("test", "valid", ["group"])
+        assert issued >= now
+        assert expires == issued + 60
+
+        # The next request trusts the reissued value
+        request = self._makeOneRequest()
+        source = fake_source_init(source.value)(None, request)
+        auth = auth_factory(None, request)
+        auth.verify_ticket = pytest.fail
+        policy._find_services = lambda request: (source, auth)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert [Everyone, Authenticated, "test", "group"] == (
+            policy.effective_principals(request)
+        )
+
+    def test_stateless_ticket_expired_reissued_without_groups(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now - 120, now - 60, None])(
+            context, request
+        )
+        auth = fake_auth_init(
+            fake_userid="test", fake_groups=["group"], valid_tickets=["valid"]
+        )(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) == "test"
+        self._respond(request)
+
+        assert source.value[4] is None
+        assert source.value[3] > now
+
+    def test_stateless_ticket_expired_revoked(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "gone", now - 120, now - 60, None])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=[])(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) is None
+
+    def test_stateless_ticket_malformed(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid", 0, "never", None])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, stateless_ttl=60)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert auth.authcomplete is True
+
+    def _respond(self, request):
+        response = pyramid.testing.DummyRequest().response
+        for callback in request.callbacks:
+            callback(request, response)
+        return response
+
+    def test_remember_timeout(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(context, request)
+        auth = fake_auth_init(fake_userid="test")(context, request)
+
+        policy = self._makeOne(source=source, auth=auth, timeout=600)
+        policy.remember(request, "test", groups=["group"])
+
+        (principal, ticket, issued, expires, groups) = source.value
+        assert issued <= time.time()
+        assert expires == issued + 600
+        assert groups == ["group"]
+        assert policy.reissue_time == 300
+
+    def test_timeout_fresh_not_reissued(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        value = ["test", "valid", now - 10, now + 590, None]
+        source = fake_source_init(value)(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, timeout=600)
+
+        assert policy.authenticated_userid(request) == "test"
+        self._respond(request)
+        assert source.value is value
+
+    def test_timeout_reissued(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now - 400, now + 200, ["g"]])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+        extended = []
+        auth.extend_ticket = lambda principal, ticket: extended.append(ticket)
+
+        policy = self._makeOne(debug=True, source=source, auth=auth, timeout=600)
+
+        assert policy.authenticated_userid(request) == "test"
+        assert extended == ["valid"]
+
+        self._respond(request)
+        (principal, ticket, issued, expires, groups) = source.value
+
+        assert (principal, ticket, groups) == ("test", "valid", ["g"])
+        assert issued >= now
+        assert expires == issued + 600
+
+    def test_timeout_legacy_value_reissued(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, timeout=600, reissue_time=0)
+
+        assert policy.authenticated_userid(request) == "test"
+        self._respond(request)
+        assert len(source.value) == 5
+        assert source.value[4] is None
+
+    def test_timeout_expired(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "valid", now - 700, now - 100, None])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(debug=True, source=source, auth=auth, timeout=600)
+
+        assert policy.authenticated_userid(request) is None
+        assert auth.authcomplete is False
+
+    def test_timeout_malformed(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid", "now", None, None])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, timeout=600)
+
+        assert policy.authenticated_userid(request) is None
+
+    def test_timeout_reissue_cancelled_by_forget(self):
+        context = None
+        request = self._makeOneRequest()
+        source = fake_source_init(["test", "valid"])(context, request)
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid"])(
+            context, request
+        )
+
+        policy = self._makeOne(source=source, auth=auth, timeout=600)
+
+        assert policy.authenticated_userid(request) == "test"
+        policy.forget(request)
+        self._respond(request)
+
+        assert source.value == [None, None]
+
+    def test_stateless_ticket_disabled(self):
+        import time
+
+        context = None
+        request = self._makeOneRequest()
+        now = int(time.time())
+        source = fake_source_init(["test", "gone", now, now + 60, None])(
+            context, request
+        )
+        auth = fake_auth_init(fake_userid="test", valid_tickets=[])(context, request)
+
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.authenticated_userid(request) is None
+
+        policy.forget(request)
+
 
 class TestAuthServicePolicyIntegration(object):
     @pytest.fixture(autouse=True)
@@ -282,6 +847,34 @@ class TestAuthServicePolicyIntegration(object):
         assert sourcesvc == "Source"
         assert authsvc == "Auth"
 
+    def test_find_services_cached(self):
+        from pyramid_authsanity.interfaces import IAuthService, IAuthSourceService
+
+        calls = []
+
+        def source(context, request):
+            calls.append("source")
+            return "Source"
+
+        self.config.register_service_factory(source, iface=IAuthSourceService)
+        self.config.register_service_factory(lambda x, y: "Auth", iface=IAuthService)
+
+        policy = self._makeOne()
+        request = self._makeOneRequest()
+        find_service = request.find_service
+        lookups = []
+
+        def counting_find_service(*args, **kw):
+            lookups.append(args)
+            return find_service(*args, **kw)
+
+        request.find_service = counting_find_service
+
+        assert policy._find_services(request) == ("Source", "Auth")
+        assert policy._find_services(request) == ("Source", "Auth")
+        assert len(lookups) == 2
+        assert calls == ["source"]
+
     def test_valid_source_ticket(self):
         request = self._makeOneRequest()
         source = fake_source_init(["test", "valid"])
@@ -304,7 +897,7 @@ class TestAuthServicePolicyIntegration(object):
 
     def test_bad_auth_service(self):
         request = self._makeOneRequest()
-        source = fake_source_init([None, None])
+        source = fake_source_init(["test", "valid"])
 
         class BadAuth(object):
             def __init__(self, context, request):
@@ -406,6 +999,62 @@ class TestAuthServicePolicyIntegration(object):
         assert len(headers) == 0
         assert len(authreq.valid_tickets) >= 1
 
+    def test_remember_same_user_keeps_session(self):
+        request = self._makeOneRequest()
+        request.session["cart"] = ["item"]
+        source = fake_source_init(["test", "valid_ticket"])
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid_ticket"])
+
+        policy = self._makeOne(source=source, auth=auth)
+        policy.remember(request, "test")
+
+        assert request.session["cart"] == ["item"]
+        assert request.session.invalidated == 1
+
+    def test_remember_configured(self):
+        request = self._makeOneRequest()
+        request.session["cart"] = ["item"]
+        source = fake_source_init(["test", "valid_ticket"])
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid_ticket"])
+
+        policy = self._makeOne(source=source, auth=auth)
+        self.config.commit()
+        policy.configure(self.config)
+
+        assert policy._have_session is True
+        assert policy._vary_callback is not None
+
+        policy.remember(request, "other")
+
+        assert "cart" not in request.session
+        assert request.callbacks == [policy._vary_callback]
+
+    def test_remember_same_user_regenerate_id(self):
+        request = self._makeOneRequest()
+        request.session["cart"] = ["item"]
+        regenerated = []
+        request.session.regenerate_id = lambda: regenerated.append(True)
+        source = fake_source_init(["test", "valid_ticket"])
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid_ticket"])
+
+        policy = self._makeOne(source=source, auth=auth)
+        policy.remember(request, "test")
+
+        assert regenerated == [True]
+        assert request.session["cart"] == ["item"]
+        assert request.session.invalidated == 0
+
+    def test_remember_other_user_invalidates_session(self):
+        request = self._makeOneRequest()
+        request.session["cart"] = ["item"]
+        source = fake_source_init(["test", "valid_ticket"])
+        auth = fake_auth_init(fake_userid="test", valid_tickets=["valid_ticket"])
+
+        policy = self._makeOne(source=source, auth=auth)
+        policy.remember(request, "other")
+
+        assert "cart" not in request.session
+
     def test_forget(self):
         request = self._makeOneRequest()
         source = fake_source_init(["test", "valid"])
@@ -423,6 +1072,162 @@ class TestAuthServicePolicyIntegration(object):
         assert "valid" not in authreq.valid_tickets
 
 
+class TestAuthServiceSecurityPolicy(object):
+    @pytest.fixture(autouse=True)
+    def pyramid_config(self, request):
+        self.config = pyramid.testing.setUp()
+
+        def finish():
+            del self.config
+            pyramid.testing.tearDown()
+
+        request.addfinalizer(finish)
+
+    def _makeOne(self, source=None, auth=None, **kw):
+        from pyramid_authsanity import AuthServiceSecurityPolicy
+
+        policy = AuthServiceSecurityPolicy(**kw)
+        policy.authn_policy._find_services = lambda request: (source, auth)
+        policy.authn_policy._session_registered = lambda request: False
+        return policy
+
+    def _makeOneRequest(self):
+        request = DummyRequest()
+        request.registry = self.config.registry
+        return request
+
+    def _makeAuthenticated(self, request, groups=()):
+        source = fake_source_init(["test", "valid"])(None, request)
+        auth = fake_auth_init(
+            fake_userid="test", fake_groups=list(groups), valid_tickets=["valid"]
+        )(None, request)
+        return (source, auth)
+
+    def test_verify(self):
+        from pyramid.interfaces import ISecurityPolicy
+
+        from pyramid_authsanity import AuthServiceSecurityPolicy
+
+        assert verifyClass(ISecurityPolicy, AuthServiceSecurityPolicy)
+        assert verifyObject(ISecurityPolicy, AuthServiceSecurityPolicy())
+
+    def test_authn_policy(self):
+        from pyramid.authorization import ACLHelper
+
+        from pyramid_authsanity import AuthServicePolicy, AuthServiceSecurityPolicy
+
+        authn_policy = AuthServicePolicy()
+        acl_helper = ACLHelper()
+        policy = AuthServiceSecurityPolicy(
+            authn_policy=authn_policy, acl_helper=acl_helper
+        )
+
+        assert policy.authn_policy is authn_policy
+        assert policy.acl_helper is acl_helper
+
+    def test_identity_anonymous(self):
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(None, request)
+        auth = fake_auth_init()(None, request)
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.identity(request) is None
+        assert policy.authenticated_userid(request) is None
+
+    def test_identity_bad_principal(self):
+        from pyramid.authorization import Everyone
+
+        request = self._makeOneRequest()
+        source = fake_source_init([Everyone, "valid"])(None, request)
+        auth = fake_auth_init(fake_userid=Everyone, valid_tickets=["valid"])(
+            None, request
+        )
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.identity(request) is None
+
+    def test_identity(self):
+        from pyramid.authorization import Authenticated, Everyone
+
+        request = self._makeOneRequest()
+        (source, auth) = self._makeAuthenticated(request, groups=["group"])
+        policy = self._makeOne(source=source, auth=auth)
+
+        identity = policy.identity(request)
+
+        assert identity.userid == "test"
+        assert identity.principals == frozenset(
+            [Everyone, Authenticated, "test", "group"]
+        )
+        assert "test" in repr(identity)
+        assert policy.authenticated_userid(request) == "test"
+
+    def test_identity_memoized(self):
+        request = self._makeOneRequest()
+        (source, auth) = self._makeAuthenticated(request)
+        policy = self._makeOne(source=source, auth=auth)
+
+        identity = policy.identity(request)
+
+        assert policy.identity(request) is identity
+
+    def test_permits(self):
+        from pyramid.authorization import Allow, Deny, Everyone
+
+        request = self._makeOneRequest()
+        (source, auth) = self._makeAuthenticated(request, groups=["group"])
+        policy = self._makeOne(source=source, auth=auth)
+        context = DummyContext(
+            [
+                (Deny, "test", "delete"),
+                (Allow, "group", ("edit", "delete")),
+                (Allow, Everyone, "view"),
+            ]
+        )
+
+        assert policy.permits(request, context, "view")
+        assert policy.permits(request, context, "edit")
+        assert not policy.permits(request, context, "delete")
+        assert not policy.permits(request, context, "other")
+
+    def test_permits_anonymous(self):
+        from pyramid.authorization import Allow, Authenticated, Everyone
+
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(None, request)
+        auth = fake_auth_init()(None, request)
+        policy = self._makeOne(source=source, auth=auth)
+        context = DummyContext(
+            [(Allow, Authenticated, "edit"), (Allow, Everyone, "view")]
+        )
+
+        assert policy.permits(request, context, "view")
+        assert not policy.permits(request, context, "edit")
+
+    def test_remember_forget(self):
+        request = self._makeOneRequest()
+        source = fake_source_init([None, None])(None, request)
+        auth = fake_auth_init(fake_userid="test")(None, request)
+        policy = self._makeOne(source=source, auth=auth)
+
+        assert policy.identity(request) is None
+
+        assert policy.remember(request, "test") == []
+        auth.verify_ticket(*source.value)
+
+        assert policy.identity(request).userid == "test"
+
+        assert policy.forget(request) == []
+        auth.ticketvalid = False
+
+        assert policy.identity(request) is None
+
+
+class DummyContext(object):
+    def __init__(self, acl):
+        self.__acl__ = acl
+
+
 class DummyLogger(object):
     def debug(self, log):
         self.logentries.append(log)
@@ -436,7 +1241,10 @@ class DummyRequest(object):
 
     def __init__(self, environ=None, session=None, registry=None, cookie=None):
         class Session(dict):
+            invalidated = 0
+
             def invalidate(self):
+                self.invalidated += 1
                 self.clear()
 
             def new_csrf_token(self):
@@ -0,0 +1,182 @@
+import threading
+
+import pytest
+
+from pyramid_authsanity.cache import GroupsCache, TTLCache
+
+
+class DummyClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(object):
+    def _makeOne(self, **kw):
+        self.clock = DummyClock()
+        return TTLCache(clock=self.clock, **kw)
+
+    def test_invalid_shards(self):
+        with pytest.raises(ValueError):
+            self._makeOne(shards=0)
+
+    def test_get_missing(self):
+        cache = self._makeOne()
+
+        assert cache.get("missing") is None
+        assert cache.get("missing", "default") == "default"
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        cache.set("key", "value")
+
+        assert cache.get("key") == "value"
+        assert len(cache) == 1
+
+    def test_default_ttl(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("key", "value")
+
+        self.clock.now += 9
+        assert cache.get("key") == "value"
+
+        self.clock.now += 1
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_entry_ttl(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("short", "value", ttl=1)
+        cache.set("forever", "value", ttl=None)
+
+        self.clock.now += 100
+        assert cache.get("short") is None
+        assert cache.get("forever") == "value"
+
+    def test_lru_eviction(self):
+        cache = self._makeOne(max_size=2, shards=1)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Touch a, so that b is the least recently used
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_bounded(self):
+        cache = self._makeOne(max_size=64, shards=4)
+
+        for i in range(1000):
+            cache.set(i, i)
+
+        assert len(cache) <= 64
+
+    def test_delete(self):
+        cache = self._makeOne()
+        cache.set("key", "value")
+
+        assert cache.delete("key") is True
+        assert cache.delete("key") is False
+        assert cache.get("key") is None
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+
+        assert len(cache) == 0
+
+    def test_hits_misses(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("key", "value")
+
+        cache.get("key")
+        cache.get("key")
+        cache.get("missing")
+        self.clock.now += 10
+        cache.get("key")
+
+        assert cache.hits == 2
+        assert cache.misses == 2
+
+    def test_threads(self):
+        cache = TTLCache(max_size=100000, shards=8)
+
+        def work(n):
+            for i in range(1000):
+                key = (n, i)
+                cache.set(key, i)
+                assert cache.get(key) == i
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        assert len(cache) == 8000
+        assert cache.hits == 8000
+
+
+class TestGroupsCache(object):
+    def _makeOne(self, **kw):
+        self.clock = DummyClock()
+        return GroupsCache(clock=self.clock, **kw)
+
+    def test_get_missing(self):
+        cache = self._makeOne()
+
+        assert cache.get("bob") is None
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        cache.set("bob", ["group:staff"])
+        groups = cache.get("bob")
+        groups.append("modified")
+
+        assert cache.get("bob") == ["group:staff"]
+
+    def test_ttl(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("bob", ["group:staff"])
+
+        self.clock.now += 10
+        assert cache.get("bob") is None
+
+    def test_invalidate(self):
+        cache = self._makeOne()
+        cache.set("bob", ["group:staff"])
+        cache.set("alice", [])
+        cache.invalidate()
+
+        assert cache.get("bob") is None
+        assert cache.get("alice") is None
+
+        cache.set("bob", ["group:admin"])
+
+        assert cache.get("bob") == ["group:admin"]
+
+    def test_set_stale_generation(self):
+        cache = self._makeOne()
+        generation = cache.generation
+        cache.invalidate()
+        cache.set("bob", ["group:staff"], generation)
+
+        assert cache.get("bob") is None
+
+    def test_invalidate_principal(self):
+        cache = self._makeOne()
+        cache.set("bob", ["group:staff"])
+        cache.set("alice", [])
+        cache.invalidate_principal("bob")
+
+        assert cache.get("bob") is None
+        assert cache.get("alice") == []
@@ -4,7 +4,7 @@ from pyramid_services import find_service_factory
 import pytest
 from zope.interface.verify import verifyClass
 
-from pyramid_authsanity.interfaces import IAuthSourceService
+from pyramid_authsanity.interfaces import IAuthService, IAuthSourceService
 
 
 class TestAuthServicePolicyIntegration(object):
@@ -87,8 +87,349 @@ class TestAuthServicePolicyIntegration(object):
             IAuthSourceService, find_service_factory(self.config, IAuthSourceService)
         )
 
+    def test_include_me_header_hashalg(self):
+        settings = {
+            "authsanity.source": "header",
+            "authsanity.secret": "sekrit",
+            "authsanity.header.hashalg": "sha256",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+
+        assert source(None, None).serializer.hashalg == "sha256"
+
+    def test_include_me_header_keyring(self):
+        settings = {
+            "authsanity.source": "header",
+            "authsanity.keyring": "k2:new k1:old",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+        serializer = source(None, None).serializer
+
+        assert serializer.kid == b"k2"
+        assert serializer.legacy is None
+
+    def test_include_me_header_keyring_mapping(self):
+        settings = {
+            "authsanity.source": "header",
+            "authsanity.keyring": {"k1": "a-very-long-secret"},
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+        serializer = source(None, None).serializer
+
+        assert serializer.kid == b"k1"
+        assert list(serializer.signers) == [b"k1"]
+
+    def test_include_me_cookie_keyring(self):
+        settings = {
+            "authsanity.source": "cookie",
+            "authsanity.secret": "sekrit",
+            "authsanity.keyring": "k1:new",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+        request = pyramid.testing.DummyRequest()
+        serializer = source(None, request).cookie.serializer
+
+        assert serializer.kid == b"k1"
+        assert serializer.legacy is not None
+
+    def test_include_me_header_encoding(self):
+        from pyramid_authsanity.sources import CompactSerializer
+
+        settings = {
+            "authsanity.source": "header",
+            "authsanity.secret": "sekrit",
+            "authsanity.header.encoding": "compact",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+        serializer = source(None, None).serializer
+
+        assert isinstance(serializer.serializer, CompactSerializer)
+
+    def test_include_me_header_cache_size(self):
+        settings = {
+            "authsanity.source": "header",
+            "authsanity.secret": "sekrit",
+            "authsanity.header.cache_size": "100",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        source = find_service_factory(self.config, IAuthSourceService)
+        serializer = source(None, None).serializer
+
+        assert serializer.cache.shard_size * 16 >= 100
+
+    def test_include_me_composite_source(self):
+        settings = {
+            "authsanity.source": "header cookie",
+            "authsanity.secret": "sekrit",
+            "authsanity.remember_source": "cookie",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        factory = find_service_factory(self.config, IAuthSourceService)
+        source = factory(None, pyramid.testing.DummyRequest())
+
+        assert verifyClass(IAuthSourceService, factory)
+        assert source.get_value() == [None, None]
+        assert source.vary == ["Authorization", "Cookie"]
+        assert source.headers_remember(["user1", "ticket1"])[0][0] == "Set-Cookie"
+
+    def test_include_me_composite_source_unknown(self):
+        settings = {"authsanity.source": "header magic", "authsanity.secret": "x"}
+
+        with pytest.raises(RuntimeError):
+            self._makeOne(settings)
+
+    def test_include_me_composite_source_bad_remember_source(self):
+        settings = {
+            "authsanity.source": "header cookie",
+            "authsanity.secret": "sekrit",
+            "authsanity.remember_source": "session",
+        }
+
+        with pytest.raises(RuntimeError):
+            self._makeOne(settings)
+
     def test_include_me_header_no_secret(self):
         settings = {"authsanity.source": "header"}
 
         with pytest.raises(RuntimeError):
             self._makeOne(settings)
+
+    def test_include_me_memory_service(self):
+        settings = {
+            "authsanity.service": "memory",
+            "authsanity.memory.max_size": "100",
+            "authsanity.memory.ttl": "3600",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert verifyClass(IAuthService, service)
+        assert service.store.ttl == 3600
+
+    def test_include_me_memory_service_groupfinder(self):
+        settings = {
+            "authsanity.service": "memory",
+            "authsanity.memory.groupfinder": "tests.test_includeme.groupfinder",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+        svc = service(None, None)
+        svc.add_ticket("bob", "ticket")
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.groups() == ["group:bob"]
+
+    def test_include_me_sql_service(self):
+        settings = {
+            "authsanity.service": "sql",
+            "authsanity.sql.connect": "sqlite3.connect",
+            "authsanity.sql.pool_size": "2",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert verifyClass(IAuthService, service)
+        assert service.pool._idle.maxsize == 2
+
+    def test_include_me_sql_service_no_connect(self):
+        settings = {"authsanity.service": "sql"}
+
+        with pytest.raises(RuntimeError):
+            self._makeOne(settings)
+
+    def test_include_me_redis_service(self):
+        settings = {
+            "authsanity.service": "redis",
+            "authsanity.redis.host": "redis.example.com",
+            "authsanity.redis.pool_size": "2",
+            "authsanity.redis.timeout": "0.5",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert verifyClass(IAuthService, service)
+        assert service.pool._idle.maxsize == 2
+
+    def test_include_me_verify_cache(self):
+        settings = {
+            "authsanity.service": "memory",
+            "authsanity.verify_cache": "true",
+            "authsanity.verify_cache.ttl": "5",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert verifyClass(IAuthService, service)
+        assert service.cache.ttl == 5
+
+    def test_include_me_verify_cache_shared(self):
+        from pyramid_authsanity.shm import SharedMemoryCache
+
+        settings = {
+            "authsanity.service": "memory",
+            "authsanity.verify_cache": "true",
+            "authsanity.verify_cache.shared": "true",
+            "authsanity.verify_cache.max_size": "100",
+            "authsanity.verify_cache.ttl": "5",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert isinstance(service.cache, SharedMemoryCache)
+        assert service.cache.slots == 100
+        assert service.cache.ttl == 5
+        assert service.cache.path is None
+
+    def test_include_me_verify_cache_shared_path(self, tmp_path):
+        path = str(tmp_path / "verify.cache")
+        settings = {
+            "authsanity.service": "memory",
+            "authsanity.verify_cache": "true",
+            "authsanity.verify_cache.shared": "true",
+            "authsanity.verify_cache.shared_path": path,
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        service = find_service_factory(self.config, IAuthService)
+
+        assert service.cache.path == path
+
+    def test_include_me_groups_cache(self):
+        from pyramid.interfaces import IAuthenticationPolicy
+
+        settings = {
+            "authsanity.groups_cache": "true",
+            "authsanity.groups_cache.ttl": "5",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        policy = self.config.registry.getUtility(IAuthenticationPolicy)
+
+        assert policy.groups_cache._cache.ttl == 5
+
+    def test_include_me_anonymous_fast_path(self):
+        from pyramid.interfaces import IAuthenticationPolicy
+
+        self._makeOne({"authsanity.anonymous_fast_path": "false"})
+        self.config.commit()
+        policy = self.config.registry.getUtility(IAuthenticationPolicy)
+
+        assert policy.anonymous_fast_path is False
+
+    def test_include_me_timeout(self):
+        from pyramid.interfaces import IAuthenticationPolicy
+
+        self._makeOne({"authsanity.timeout": "600", "authsanity.reissue_time": "60"})
+        self.config.commit()
+        policy = self.config.registry.getUtility(IAuthenticationPolicy)
+
+        assert policy.timeout == 600
+        assert policy.reissue_time == 60
+
+    def test_include_me_configures_policy(self):
+        from pyramid.interfaces import IAuthenticationPolicy, IDebugLogger
+        from pyramid.session import SignedCookieSessionFactory
+
+        from pyramid_authsanity.util import add_vary_callback
+
+        logger = object()
+        self.config.registry.registerUtility(logger, IDebugLogger)
+        self.config.set_session_factory(SignedCookieSessionFactory("seekrit"))
+        self._makeOne({"authsanity.source": "cookie", "authsanity.secret": "sekrit"})
+        self.config.commit()
+        policy = self.config.registry.getUtility(IAuthenticationPolicy)
+
+        assert policy._have_session is True
+        assert policy._logger is logger
+        assert policy._vary_callback is add_vary_callback(["Cookie"])
+
+    def test_include_me_configures_policy_dynamic_vary(self):
+        from pyramid.interfaces import ISecurityPolicy
+
+        settings = {
+            "authsanity.source": "header cookie",
+            "authsanity.secret": "sekrit",
+            "authsanity.security_policy": "true",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        policy = self.config.registry.getUtility(ISecurityPolicy).authn_policy
+
+        assert policy._have_session is False
+        assert policy._logger is None
+        assert policy._vary_callback is None
+
+    def test_include_me_configures_policy_no_source(self):
+        from pyramid.interfaces import IAuthenticationPolicy
+
+        self._makeOne({})
+        self.config.commit()
+        policy = self.config.registry.getUtility(IAuthenticationPolicy)
+
+        assert policy._vary_callback is None
+
+    def test_include_me_stateless_ttl(self):
+        from pyramid.interfaces import ISecurityPolicy
+
+        settings = {
+            "authsanity.security_policy": "true",
+            "authsanity.stateless_ttl": "300",
+        }
+
+        self._makeOne(settings)
+        self.config.commit()
+        policy = self.config.registry.getUtility(ISecurityPolicy)
+
+        assert policy.authn_policy.stateless_ttl == 300
+
+    def test_include_me_security_policy(self):
+        from pyramid.interfaces import IAuthenticationPolicy, ISecurityPolicy
+
+        from pyramid_authsanity.policy import AuthServiceSecurityPolicy
+
+        settings = {"authsanity.security_policy": "true"}
+
+        self._makeOne(settings)
+        self.config.commit()
+        policy = self.config.registry.getUtility(ISecurityPolicy)
+
+        assert isinstance(policy, AuthServiceSecurityPolicy)
+        assert self.config.registry.queryUtility(IAuthenticationPolicy) is None
+
+
+def groupfinder(userid, request):
+    return ["group:" + userid]
@@ -0,0 +1,489 @@
+import io
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+from zope.interface.verify import verifyObject
+
+from pyramid_authsanity import resp
+from pyramid_authsanity.interfaces import IAuthService
+
+
+class FakeRESPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+
+        with server.lock:
+            server.clients.append(self.connection)
+
+        while True:
+            command = self.read_command()
+
+            if command is None:
+                return
+
+            with server.lock:
+                server.commands.append(command)
+                reply = server.dispatch(self, command)
+
+            self.wfile.write(reply)
+
+    def read_command(self):
+        line = self.rfile.readline()
+
+        if not line:
+            return None
+
+        args = []
+
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+
+        return [args[0].decode("ascii").upper()] + args[1:]
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeRESPServer(socketserver.ThreadingTCPServer):
+    """Just enough of a Redis server to test against."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ("127.0.0.1", 0), FakeRESPHandler
+        )
+        self.password = password
+        self.lock = threading.Lock()
+        self.clients = []
+        self.commands = []
+        self.data = {}
+        self.expires = {}
+
+    def _get(self, key):
+        expires = self.expires.get(key)
+
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        return self.data.get(key)
+
+    def dispatch(self, handler, command):
+        (name, args) = (command[0], command[1:])
+
+        if name == "AUTH":
+            if args[0].decode("utf-8") != self.password:
+                return b"-WRONGPASS invalid password\r\n"
+            return b"+OK\r\n"
+
+        if name == "SELECT":
+            handler.db = int(args[0])
+            return b"+OK\r\n"
+
+        if name == "GET":
+            return _bulk(self._get(args[0]))
+
+        if name == "SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+
+            if len(args) == 4 and args[2].upper() == b"EX":
+                self.expires[args[0]] = time.time() + int(args[3])
+            return b"+OK\r\n"
+
+        if name == "EXPIRE":
+            if self._get(args[0]) is None:
+                return b":0\r\n"
+            self.expires[args[0]] = time.time() + int(args[1])
+            return b":1\r\n"
+
+        if name == "DEL":
+            found = self._get(args[0]) is not None
+            self.data.pop(args[0], None)
+            return b":%d\r\n" % (found,)
+
+        if name == "SMEMBERS":
+            members = self._get(args[0]) or set()
+
+            if not isinstance(members, set):
+                return b"-WRONGTYPE Operation against a key holding the wrong kind\r\n"
+
+            members = sorted(members)
+            return b"*%d\r\n" % (len(members),) + b"".join(_bulk(m) for m in members)
+
+        return b"-ERR unknown command '%s'\r\n" % (name.encode("ascii"),)
+
+    def drop_clients(self):
+        with self.lock:
+            for client in self.clients:
+                client.shutdown(socket.SHUT_RDWR)
+
+            self.clients = []
+
+
+@pytest.fixture
+def server():
+    server = FakeRESPServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def _connection(data):
+    conn = resp.RESPConnection.__new__(resp.RESPConnection)
+    conn._file = io.BytesIO(data)
+    return conn
+
+
+class TestEncodeCommand(object):
+    def test_encode(self):
+        assert resp.encode_command("SET", b"key", "valu\xe9", 10) == (
+            b"*4\r\n$3\r\nSET\r\n$3\r\nkey\r\n$6\r\nvalu\xc3\xa9\r\n$2\r\n10\r\n"
+        )
+
+
+class TestRESPConnectionReplies(object):
+    def test_simple_string(self):
+        assert _connection(b"+OK\r\n")._read_reply() == "OK"
+
+    def test_error(self):
+        reply = _connection(b"-ERR no\r\n")._read_reply()
+
+        assert isinstance(reply, resp.RESPError)
+        assert str(reply) == "ERR no"
+
+    def test_integer(self):
+        assert _connection(b":-12\r\n")._read_reply() == -12
+
+    def test_bulk_string(self):
+        assert _connection(b"$4\r\na\r\nb\r\n")._read_reply() == b"a\r\nb"
+        assert _connection(b"$0\r\n\r\n")._read_reply() == b""
+
+    def test_null_bulk_string(self):
+        assert _connection(b"$-1\r\n")._read_reply() is None
+
+    def test_array(self):
+        conn = _connection(b"*3\r\n:1\r\n$1\r\na\r\n*1\r\n+OK\r\n")
+
+        assert conn._read_reply() == [1, b"a", ["OK"]]
+
+    def test_null_array(self):
+        assert _connection(b"*-1\r\n")._read_reply() is None
+
+    def test_unexpected(self):
+        with pytest.raises(resp.RESPError):
+            _connection(b"!oops\r\n")._read_reply()
+
+    def test_closed(self):
+        with pytest.raises(ConnectionError):
+            _connection(b"")._read_reply()
+
+    def test_truncated_line(self):
+        with pytest.raises(ConnectionError):
+            _connection(b"+OK")._read_reply()
+
+    def test_truncated_bulk_string(self):
+        with pytest.raises(ConnectionError):
+            _connection(b"$10\r\nabc")._read_reply()
+
+
+class TestRESPConnection(object):
+    def _makeOne(self, server, **kw):
+        (host, port) = server.server_address
+        return resp.RESPConnection(host=host, port=port, timeout=5, **kw)
+
+    def test_pipeline(self, server):
+        conn = self._makeOne(server)
+
+        assert conn.execute(("SET", "a", "1"), ("GET", "a"), ("GET", "b")) == [
+            "OK",
+            b"1",
+            None,
+        ]
+        conn.close()
+
+    def test_error_reply(self, server):
+        conn = self._makeOne(server)
+
+        with pytest.raises(resp.RESPError):
+            conn.execute(("NOPE",), ("SET", "a", "1"))
+
+        # Every reply was read, the connection is still usable
+        assert conn.execute(("GET", "a")) == [b"1"]
+        conn.close()
+
+    def test_auth_and_select(self, server):
+        server.password = "secret"
+        conn = self._makeOne(server, password="secret", db=2)
+
+        assert server.commands == [["AUTH", b"secret"], ["SELECT", b"2"]]
+        conn.close()
+
+    def test_auth_failure(self, server):
+        server.password = "secret"
+
+        with pytest.raises(resp.RESPError):
+            self._makeOne(server, password="wrong")
+
+    def test_no_setup_commands(self, server):
+        conn = self._makeOne(server)
+        conn.execute(("GET", "a"))
+
+        assert server.commands == [["GET", b"a"]]
+        conn.close()
+
+
+class TestRedisAuthService(object):
+    @pytest.fixture(autouse=True)
+    def fake_server(self, server):
+        self.server = server
+        server.data[b"authsanity:groups:bob"] = {b"group:staff", b"group:admin"}
+
+    def _makeOne(self, **kw):
+        (host, port) = self.server.server_address
+        self.factory = resp.RedisAuthServiceInitializer(
+            host=host, port=port, timeout=5, **kw
+        )
+        return self.factory(None, None)
+
+    def _count_sends(self):
+        sends = []
+
+        with self.factory.pool.connection() as conn:
+            sendall = conn._sock.sendall
+
+        class Socket(object):
+            def sendall(self, data):
+                sends.append(data)
+                return sendall(data)
+
+        conn._sock = Socket()
+        return sends
+
+    def test_verify_object(self):
+        assert verifyObject(IAuthService, self._makeOne())
+
+    def test_userid_unverified(self):
+        svc = self._makeOne()
+
+        with pytest.raises(ValueError):
+            svc.userid()
+
+    def test_add_verify(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+
+        svc = self.factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+        assert svc.groups() == ["group:admin", "group:staff"]
+        assert self.server.data[b"authsanity:ticket:ticket"] == b"bob"
+
+    def test_verify_is_one_round_trip(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+        sends = self._count_sends()
+
+        svc = self.factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+        svc.groups()
+
+        assert svc.userid() == "bob"
+        assert len(sends) == 1
+        assert self.server.commands[-2:] == [
+            ["GET", b"authsanity:ticket:ticket"],
+            ["SMEMBERS", b"authsanity:groups:bob"],
+        ]
+
+    def test_integer_principal(self):
+        self.server.data[b"authsanity:groups:42"] = {b"group:staff"}
+        svc = self._makeOne()
+        svc.add_ticket(42, "ticket")
+
+        svc = self.factory(None, None)
+        svc.verify_ticket(42, "ticket")
+
+        assert svc.userid() == 42
+        assert svc.groups() == ["group:staff"]
+        assert self.server.data[b"authsanity:ticket:ticket"] == b"42"
+
+        svc.verify_ticket(43, "ticket")
+        assert svc.userid() is None
+
+    def test_verify_unknown_ticket(self):
+        svc = self._makeOne()
+        svc.verify_ticket("bob", "unknown")
+
+        assert svc.userid() is None
+        assert svc.groups() == []
+
+    def test_verify_wrong_principal(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+        svc.verify_ticket("alice", "ticket")
+
+        assert svc.userid() is None
+        assert svc.groups() == []
+
+    def test_verify_none(self):
+        svc = self._makeOne()
+        svc.verify_ticket(None, "ticket")
+        svc.verify_ticket("bob", None)
+
+        assert svc.userid() is None
+        assert self.server.commands == []
+
+    def test_no_groups(self):
+        svc = self._makeOne()
+        svc.add_ticket("alice", "ticket")
+        svc.verify_ticket("alice", "ticket")
+
+        assert svc.userid() == "alice"
+        assert svc.groups() == []
+
+    def test_ttl(self):
+        svc = self._makeOne(ttl=60)
+        svc.add_ticket("bob", "ticket")
+        key = b"authsanity:ticket:ticket"
+
+        assert self.server.commands[-1] == ["SET", key, b"bob", b"EX", b"60"]
+
+        self.server.expires[key] = time.time() - 1
+        svc.verify_ticket("bob", "ticket")
+        assert svc.userid() is None
+
+    def test_no_ttl(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+        svc.extend_ticket("bob", "ticket")
+
+        assert self.server.commands == [["SET", b"authsanity:ticket:ticket", b"bob"]]
+
+    def test_extend_ticket(self):
+        svc = self._makeOne(ttl=60)
+        svc.add_ticket("bob", "ticket")
+        svc.extend_ticket("bob", "ticket")
+
+        assert self.server.commands[-1] == [
+            "EXPIRE",
+            b"authsanity:ticket:ticket",
+            b"60",
+        ]
+
+    def test_extend_expired_ticket(self):
+        svc = self._makeOne(ttl=60)
+        svc.add_ticket("bob", "ticket")
+        self.server.expires[b"authsanity:ticket:ticket"] = time.time() - 1
+
+        svc.extend_ticket("bob", "ticket")
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+    def test_remove_ticket(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+
+        assert svc.remove_ticket("ticket") is True
+        assert svc.remove_ticket("ticket") is False
+
+        svc.verify_ticket("bob", "ticket")
+        assert svc.userid() is None
+
+    def test_remove_no_ticket(self):
+        svc = self._makeOne()
+
+        assert svc.remove_ticket(None) is False
+        assert self.server.commands == []
+
+    def test_forget_anonymous(self):
+        from pyramid.testing import DummyRequest
+
+        from pyramid_authsanity.policy import AuthServicePolicy
+        from pyramid_authsanity.sources import HeaderAuthSourceInitializer
+
+        request = DummyRequest()
+        source = HeaderAuthSourceInitializer("seekrit")(None, request)
+        svc = self._makeOne()
+        policy = AuthServicePolicy()
+        policy._find_services = lambda request: (source, svc)
+
+        assert policy.forget(request) == []
+        assert self.server.commands == []
+
+    def test_prefix(self):
+        svc = self._makeOne(prefix="app:")
+        svc.add_ticket("bob", "ticket")
+
+        assert b"app:ticket:ticket" in self.server.data
+
+    def test_reuses_connections(self):
+        svc = self._makeOne(pool_size=1)
+
+        for i in range(5):
+            svc.verify_ticket("bob", "ticket%d" % (i,))
+
+        assert len(self.server.clients) == 1
+
+    def test_reconnects_after_connection_dropped(self):
+        svc = self._makeOne()
+        svc.add_ticket("bob", "ticket")
+
+        self.server.drop_clients()
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_server_error(self):
+        svc = self._makeOne()
+        self.server.data[b"authsanity:groups:alice"] = b"not a set"
+        svc.add_ticket("alice", "ticket")
+
+        with pytest.raises(resp.RESPError):
+            svc.verify_ticket("alice", "ticket")
+
+    def test_threads(self):
+        svc = self._makeOne(pool_size=2)
+        svc.add_ticket("bob", "ticket")
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(20):
+                    svc = self.factory(None, None)
+                    svc.verify_ticket("bob", "ticket")
+                    assert svc.userid() == "bob"
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+
+    def test_pool(self):
+        pool = object()
+        factory = resp.RedisAuthServiceInitializer(pool=pool)
+
+        assert factory.pool is pool
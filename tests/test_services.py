@@ -0,0 +1,285 @@
+import pytest
+from zope.interface.verify import verifyObject
+
+from pyramid_authsanity import services
+from pyramid_authsanity.interfaces import IAuthService
+
+
+class TestMemoryAuthService(object):
+    def _makeOne(self, request=None, **kw):
+        obj = services.MemoryAuthServiceInitializer(**kw)
+
+        return obj(None, request or DummyRequest())
+
+    def test_verify_object(self):
+        assert verifyObject(IAuthService, self._makeOne())
+
+    def test_userid_not_verified(self):
+        svc = self._makeOne()
+
+        with pytest.raises(ValueError):
+            svc.userid()
+
+    def test_verify_no_ticket(self):
+        svc = self._makeOne()
+        svc.verify_ticket(None, None)
+
+        assert svc.userid() is None
+        assert svc.groups() == []
+
+    def test_add_verify_ticket(self):
+        factory = services.MemoryAuthServiceInitializer()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_verify_wrong_principal(self):
+        factory = services.MemoryAuthServiceInitializer()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("alice", "ticket")
+
+        assert svc.userid() is None
+
+    def test_remove_ticket(self):
+        factory = services.MemoryAuthServiceInitializer()
+        svc = factory(None, DummyRequest())
+        svc.add_ticket("bob", "ticket")
+
+        assert svc.remove_ticket("ticket") is True
+        assert svc.remove_ticket("ticket") is False
+
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+    def test_ticket_ttl(self):
+        from pyramid_authsanity.cache import TTLCache
+
+        now = [0]
+        store = TTLCache(ttl=60, clock=lambda: now[0])
+        factory = services.MemoryAuthServiceInitializer(store=store)
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        now[0] = 61
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+    def test_extend_ticket(self):
+        from pyramid_authsanity.cache import TTLCache
+
+        now = [0]
+        store = TTLCache(ttl=60, clock=lambda: now[0])
+        factory = services.MemoryAuthServiceInitializer(store=store)
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        now[0] = 50
+        factory(None, DummyRequest()).extend_ticket("bob", "ticket")
+        factory(None, DummyRequest()).extend_ticket("alice", "other")
+
+        now[0] = 100
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+        assert store.get("other") is None
+
+    def test_store_shared(self):
+        factory = services.MemoryAuthServiceInitializer(max_size=10, ttl=5)
+
+        assert factory.store.ttl == 5
+        assert factory(None, DummyRequest()).store is factory.store
+
+    def test_groupfinder(self):
+        def groupfinder(userid, request):
+            assert request is dummy
+            return ("group:" + userid,)
+
+        dummy = DummyRequest()
+        factory = services.MemoryAuthServiceInitializer(groupfinder=groupfinder)
+        svc = factory(None, dummy)
+        svc.add_ticket("bob", "ticket")
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.groups() == ["group:bob"]
+
+    def test_groupfinder_no_user(self):
+        calls = []
+        svc = self._makeOne(groupfinder=lambda *args: calls.append(args))
+        svc.verify_ticket("bob", "invalid")
+
+        assert svc.groups() == []
+        assert calls == []
+
+
+class TestCachingAuthService(object):
+    def _makeFactory(self, **kw):
+        self.backend = services.MemoryAuthServiceInitializer(
+            groupfinder=lambda userid, request: ["group:" + userid]
+        )
+        self.calls = []
+        calls = self.calls
+        backend = self.backend
+
+        class CountingService(backend):
+            def verify_ticket(self, principal, ticket):
+                calls.append((principal, ticket))
+                return backend.verify_ticket(self, principal, ticket)
+
+        return services.CachingAuthServiceInitializer(CountingService, **kw)
+
+    def _verify(self, factory, principal, ticket):
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket(principal, ticket)
+        return svc
+
+    def test_verify_object(self):
+        factory = self._makeFactory()
+
+        assert verifyObject(IAuthService, factory(None, DummyRequest()))
+
+    def test_userid_not_verified(self):
+        svc = self._makeFactory()(None, DummyRequest())
+
+        with pytest.raises(ValueError):
+            svc.userid()
+
+    def test_positive_cached(self):
+        factory = self._makeFactory()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        assert self._verify(factory, "bob", "ticket").userid() == "bob"
+        assert self._verify(factory, "bob", "ticket").userid() == "bob"
+        assert len(self.calls) == 1
+
+    def test_negative_cached(self):
+        factory = self._makeFactory()
+
+        assert self._verify(factory, "bob", "invalid").userid() is None
+        assert self._verify(factory, "bob", "invalid").userid() is None
+        assert len(self.calls) == 1
+
+    def test_no_ticket_not_cached(self):
+        factory = self._makeFactory()
+
+        assert self._verify(factory, None, None).userid() is None
+        assert self._verify(factory, None, None).userid() is None
+        assert len(self.calls) == 2
+        assert len(factory.cache) == 0
+
+    def test_principal_mismatch(self):
+        factory = self._makeFactory()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        assert self._verify(factory, "bob", "ticket").userid() == "bob"
+        assert self._verify(factory, "alice", "ticket").userid() is None
+        assert len(self.calls) == 2
+
+    def test_groups_after_cache_hit(self):
+        factory = self._makeFactory()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+        self._verify(factory, "bob", "ticket")
+
+        svc = self._verify(factory, "bob", "ticket")
+        assert len(self.calls) == 1
+
+        assert svc.groups() == ["group:bob"]
+        assert svc.groups() == ["group:bob"]
+        assert len(self.calls) == 2
+
+    def test_groups_after_cache_miss(self):
+        factory = self._makeFactory()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+        svc = self._verify(factory, "bob", "ticket")
+
+        assert svc.groups() == ["group:bob"]
+        assert len(self.calls) == 1
+
+    def test_extend_ticket(self):
+        factory = self._makeFactory()
+        extended = []
+        self.backend.extend_ticket = lambda self, principal, ticket: extended.append(
+            (principal, ticket)
+        )
+
+        factory(None, DummyRequest()).extend_ticket("bob", "ticket")
+
+        assert extended == [("bob", "ticket")]
+
+    def test_extend_ticket_unsupported(self):
+        class Backend(object):
+            def __init__(self, context, request):
+                pass
+
+        factory = services.CachingAuthServiceInitializer(Backend)
+
+        factory(None, DummyRequest()).extend_ticket("bob", "ticket")
+
+    def test_remove_ticket_invalidates(self):
+        factory = self._makeFactory()
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+        self._verify(factory, "bob", "ticket")
+
+        assert factory(None, DummyRequest()).remove_ticket("ticket") is True
+        assert self._verify(factory, "bob", "ticket").userid() is None
+
+    def test_add_ticket_invalidates_negative(self):
+        factory = self._makeFactory()
+
+        assert self._verify(factory, "bob", "ticket").userid() is None
+
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+
+        assert self._verify(factory, "bob", "ticket").userid() == "bob"
+
+    def test_negative_ttl(self):
+        from pyramid_authsanity.cache import TTLCache
+
+        now = [0]
+        cache = TTLCache(clock=lambda: now[0])
+        factory = self._makeFactory(cache=cache, ttl=60, negative_ttl=1)
+        factory(None, DummyRequest()).add_ticket("bob", "ticket")
+        self._verify(factory, "bob", "ticket")
+        self._verify(factory, "bob", "invalid")
+
+        now[0] = 2
+        self._verify(factory, "bob", "ticket")
+        self._verify(factory, "bob", "invalid")
+
+        assert self.calls == [
+            ("bob", "ticket"),
+            ("bob", "invalid"),
+            ("bob", "invalid"),
+        ]
+
+    def test_backend_userid_raises(self):
+        class BadService(object):
+            def __init__(self, context, request):
+                pass
+
+            def verify_ticket(self, principal, ticket):
+                pass
+
+            def userid(self):
+                raise ValueError()
+
+        factory = services.CachingAuthServiceInitializer(BadService)
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("bob", "ticket")
+
+        assert factory.cache.get("ticket") == ("bob", None)
+
+        svc = factory(None, DummyRequest())
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+
+class DummyRequest(object):
+    pass
@@ -0,0 +1,326 @@
+import multiprocessing
+import os
+
+import pytest
+
+from pyramid_authsanity.shm import SharedMemoryCache
+
+
+class DummyClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _fork_context():
+    if "fork" not in multiprocessing.get_all_start_methods():  # pragma: no cover
+        pytest.skip("requires fork")
+
+    return multiprocessing.get_context("fork")
+
+
+# The children exit with os._exit, so coverage never records them
+def _writer(cache, start, count):  # pragma: no cover
+    for i in range(start, start + count):
+        cache.set("key%d" % (i,), ["principal%d" % (i,), i])
+
+    os._exit(0)
+
+
+def _hammer(cache, keys, rounds, seed):  # pragma: no cover
+    wrong = 0
+
+    for i in range(rounds):
+        key = keys[(i * seed) % len(keys)]
+        value = cache.get(key)
+
+        if value is not None and value != [key, key * 3]:
+            wrong += 1
+
+        cache.set(key, [key, key * 3])
+
+        if i % 7 == seed:
+            cache.delete(key)
+
+    os._exit(1 if wrong else 0)
+
+
+class TestSharedMemoryCache(object):
+    def _makeOne(self, **kw):
+        self.clock = DummyClock()
+        return SharedMemoryCache(clock=self.clock, **kw)
+
+    def _slot_key(self, cache, offset, exclude):
+        for i in range(10000):
+            key = "k%d" % (i,)
+
+            if key != exclude and next(cache._offsets(cache._hash(key))) == offset:
+                return key
+
+    def test_invalid_max_size(self):
+        with pytest.raises(ValueError):
+            self._makeOne(max_size=0)
+
+    def test_get_missing(self):
+        cache = self._makeOne()
+
+        assert cache.get("missing") is None
+        assert cache.get("missing", "default") == "default"
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        cache.set("key", ["principal", "userid"])
+        cache.set(b"bytes", None)
+
+        assert cache.get("key") == ["principal", "userid"]
+        assert cache.get(b"bytes", "default") is None
+        assert len(cache) == 2
+
+    def test_replace(self):
+        cache = self._makeOne()
+        cache.set("key", "one")
+        cache.set("key", "two")
+
+        assert cache.get("key") == "two"
+        assert len(cache) == 1
+
+    def test_default_ttl(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("key", "value")
+
+        self.clock.now += 9
+        assert cache.get("key") == "value"
+
+        self.clock.now += 1
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_entry_ttl(self):
+        cache = self._makeOne(ttl=10)
+        cache.set("short", "value", ttl=1)
+        cache.set("forever", "value", ttl=None)
+
+        self.clock.now += 100
+        assert cache.get("short") is None
+        assert cache.get("forever") == "value"
+
+    def test_delete(self):
+        cache = self._makeOne()
+        cache.set("key", "value")
+
+        assert cache.delete("key") is True
+        assert cache.delete("key") is False
+        assert cache.get("key") is None
+
+    def test_evicts_soonest_to_expire(self):
+        cache = self._makeOne(max_size=2, ttl=10)
+        cache.set("a", 1, ttl=20)
+        cache.set("b", 2)
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_reuses_expired_slot(self):
+        cache = self._makeOne(max_size=2, ttl=10)
+        cache.set("a", 1, ttl=None)
+        cache.set("b", 2)
+
+        self.clock.now += 10
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_set_removes_other_copies(self):
+        cache = self._makeOne(max_size=2)
+        first = next(cache._offsets(cache._hash("key")))
+        other = self._slot_key(cache, first, "key")
+
+        # key ends up in its second slot, then its first slot is freed
+        cache.set(other, "other")
+        cache.set("key", "old")
+        cache.delete(other)
+        cache.set("key", "new")
+
+        assert cache.get("key") == "new"
+        assert len(cache) == 1
+        assert cache.delete("key") is True
+        assert cache.get("key") is None
+
+    def test_value_too_large(self):
+        cache = self._makeOne(value_size=16)
+        cache.set("small", "x" * 10)
+        cache.set("large", "x" * 20)
+
+        assert cache.get("small") == "x" * 10
+        assert cache.get("large") is None
+
+    def test_value_not_serializable(self):
+        cache = self._makeOne()
+        cache.set("key", object())
+
+        assert cache.get("key") is None
+
+    def test_torn_slot(self):
+        cache = self._makeOne(max_size=1)
+        cache.set("key", "value")
+
+        cache._mm[len(cache._mm) - cache.value_size] ^= 0xFF
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_bad_length(self):
+        cache = self._makeOne(max_size=1, value_size=16)
+        cache.set("key", "value")
+
+        offset = len(cache._mm) - cache.value_size - 2
+        cache._mm[offset : offset + 2] = b"\xff\xff"
+        assert cache.get("key") is None
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.clear()
+
+        assert len(cache) == 0
+        assert cache.get("a") is None
+
+    def test_hits_misses(self):
+        cache = self._makeOne()
+        cache.set("key", "value")
+        cache.get("key")
+        cache.get("key")
+        cache.get("missing")
+
+        assert cache.hits == 2
+        assert cache.misses == 1
+
+    def test_path(self, tmp_path):
+        path = str(tmp_path / "cache")
+        cache = self._makeOne(path=path)
+        cache.set("key", "value")
+
+        other = self._makeOne(path=path)
+        assert other.get("key") == "value"
+
+        other.set("other", "value")
+        assert cache.get("other") == "value"
+
+        cache.close()
+        other.close()
+
+    def test_path_different_parameters(self, tmp_path):
+        path = str(tmp_path / "cache")
+        cache = self._makeOne(path=path, max_size=10)
+        cache.set("key", "value")
+        cache.close()
+
+        cache = self._makeOne(path=path, max_size=20)
+        assert cache.get("key") is None
+
+        # Same size, different layout
+        cache.set("key", "value")
+        cache.close()
+        cache = self._makeOne(path=path, max_size=10, value_size=256 * 2 + 34)
+        assert cache.get("key") is None
+        cache.close()
+
+    def test_path_different_parameters_old_mapping_kept(self, tmp_path):
+        path = str(tmp_path / "cache")
+        old = self._makeOne(path=path, max_size=10)
+        old.set("key", "value")
+
+        new = self._makeOne(path=path, max_size=20)
+
+        # The old file is replaced, not reset under the processes using it
+        assert old.get("key") == "value"
+        old.set("other", "value")
+        assert new.get("other") is None
+        assert sorted(os.listdir(str(tmp_path))) == ["cache"]
+
+        old.close()
+        new.close()
+
+    def test_path_replaced_while_waiting(self, tmp_path, monkeypatch):
+        from pyramid_authsanity import shm
+
+        path = str(tmp_path / "cache")
+        first = self._makeOne(path=path)
+        first.set("key", "value")
+        results = [False]
+
+        def same_file(fd, path):
+            # Pretend the file was replaced once, the cache must reopen it
+            results.append(True)
+            return results.pop(0)
+
+        monkeypatch.setattr(shm, "_same_file", same_file)
+        second = self._makeOne(path=path)
+
+        assert second.get("key") == "value"
+        first.close()
+        second.close()
+
+    def test_shared_with_forked_processes(self):
+        ctx = _fork_context()
+        cache = SharedMemoryCache(max_size=1000)
+        processes = [
+            ctx.Process(target=_writer, args=(cache, i * 50, 50)) for i in range(4)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        found = [cache.get("key%d" % (i,)) for i in range(200)]
+        assert sum(1 for value in found if value is not None) > 190
+
+        for (i, value) in enumerate(found):
+            assert value is None or value == ["principal%d" % (i,), i]
+
+    def test_concurrent_writers_never_return_wrong_values(self):
+        ctx = _fork_context()
+        cache = SharedMemoryCache(max_size=8, probes=4)
+        keys = [str(i) for i in range(16)]
+        processes = [
+            ctx.Process(target=_hammer, args=(cache, keys, 5000, seed))
+            for seed in range(1, 5)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+    def test_as_verify_cache(self):
+        from pyramid_authsanity.services import (
+            CachingAuthServiceInitializer,
+            MemoryAuthServiceInitializer,
+        )
+
+        backend = MemoryAuthServiceInitializer()
+        cache = self._makeOne(ttl=30)
+        factory = CachingAuthServiceInitializer(backend, cache=cache)
+
+        factory(None, None).add_ticket("alice", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("alice", "ticket")
+        assert svc.userid() == "alice"
+
+        backend.store.delete("ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("alice", "ticket")
+        assert svc.userid() == "alice"
+        assert cache.hits == 1
@@ -77,6 +77,33 @@ class TestSessionAuthSource(_TestAuthSource):
         assert val2 == [None, None]
         assert request.session["sanity.value"] == "test"
 
+    def test_session_not_accessed(self):
+        request = DummyRequest()
+        del request.session
+
+        self._makeOne(request=request)
+
+    def test_remember_unchanged_not_written(self):
+        class Session(dict):
+            writes = 0
+
+            def __setitem__(self, key, value):
+                self.writes += 1
+                dict.__setitem__(self, key, value)
+
+        request = DummyRequest()
+        request.session = Session()
+        source = self._makeOne(request=request)
+        source.headers_remember(["user1", "ticket1"])
+        source.headers_remember(["user1", "ticket1"])
+
+        assert request.session.writes == 1
+
+        source.headers_remember(["user1", "ticket2"])
+
+        assert request.session.writes == 2
+        assert request.session["sanity.value"] == ["user1", "ticket2"]
+
 
 class TestCookieAuthSource(_TestAuthSource):
     def _makeOne(self, request=None):
@@ -167,6 +194,14 @@ class TestCookieAuthSource(_TestAuthSource):
 
         assert val == ["user1", "ticket1"]
 
+    def test_signer_shared_between_requests(self):
+        obj = sources.CookieAuthSourceInitializer("seekrit")
+        source1 = obj(None, DummyRequest())
+        source2 = obj(None, DummyRequest())
+
+        assert source1.cookie is not source2.cookie
+        assert source1.cookie.serializer is source2.cookie.serializer
+
 
 class TestHeaderAuthSource(_TestAuthSource):
     def _makeOne(self, request=None):
@@ -225,6 +260,453 @@ class TestHeaderAuthSource(_TestAuthSource):
 
         assert val == "test"
 
+    def test_round_trip_authorization_blake2b(self):
+        obj = sources.HeaderAuthSourceInitializer("seekrit", hashalg="blake2b")
+        headers = obj(None, DummyRequest()).headers_remember(["user1", "ticket1"])
+        (_, token) = headers[0][1].split(" ")
+
+        request = DummyRequest()
+        request.authorization = ("Bearer", token)
+        val = obj(None, request).get_value()
+
+        assert val == ["user1", "ticket1"]
+
+    def test_hashalg_mismatch(self):
+        obj = sources.HeaderAuthSourceInitializer("seekrit", hashalg="blake2b")
+        headers = obj(None, DummyRequest()).headers_remember(["user1", "ticket1"])
+        (_, token) = headers[0][1].split(" ")
+
+        request = DummyRequest()
+        request.authorization = ("Bearer", token)
+        val = self._makeOne(request=request).get_value()
+
+        assert val == [None, None]
+
+    def test_invalid_hashalg(self):
+        with pytest.raises(ValueError):
+            sources.HeaderAuthSourceInitializer("seekrit", hashalg="invalid")
+
+    def test_serializer_shared_between_requests(self):
+        obj = sources.HeaderAuthSourceInitializer("seekrit")
+        source1 = obj(None, DummyRequest())
+        source2 = obj(None, DummyRequest())
+
+        assert source1.serializer is source2.serializer
+
+
+class TestCompactSerializer(object):
+    TICKET = "BgpsOXBdmAbLDbTVL9pmnpG2vgPiSR9DbBWhLXbhjeU"
+
+    def _makeOne(self):
+        return sources.CompactSerializer()
+
+    @pytest.mark.parametrize(
+        "value",
+        [
+            ["user1", TICKET],
+            ["us\u00e9r", "ticket1"],
+            ["user1", TICKET, 1700000000, 1700000300, ["group:a", "group:b"]],
+            ["user1", TICKET, 1700000000, 1700000300, []],
+            ["user1", "ticket1", -1, 0, None],
+            # Not the canonical encoding of 32 bytes, kept as text
+            ["user1", TICKET[:-1] + "V"],
+            ["user1", "a" * 42 + "*"],
+        ],
+    )
+    def test_round_trip(self, value):
+        serializer = self._makeOne()
+        data = serializer.dumps(value)
+
+        assert data[:1] in (b"\x01", b"\x02")
+        assert serializer.loads(data) == value
+
+    def test_raw_ticket(self):
+        import json
+
+        data = self._makeOne().dumps(["user1", self.TICKET])
+
+        assert len(data) == 1 + 1 + 32 + 2 + 5
+        assert len(data) < len(json.dumps(["user1", self.TICKET]))
+
+    @pytest.mark.parametrize(
+        "value",
+        [
+            [None, None],
+            "test",
+            ["user1"],
+            [1, "ticket1"],
+            ["user1", TICKET, 1.5, 2, None],
+            ["user1", TICKET, 1, 2, [None]],
+            ["user1", TICKET, 1, 2**64, None],
+            ["x" * 70000, "ticket1"],
+        ],
+    )
+    def test_json_fallback(self, value):
+        serializer = self._makeOne()
+        data = serializer.dumps(value)
+
+        assert data[:1] not in (b"\x01", b"\x02")
+        assert serializer.loads(data) == value
+
+    def test_too_many_groups(self):
+        groups = ["g"] * 0xFFFF
+        value = ["user1", self.TICKET, 1, 2, groups]
+        data = self._makeOne().dumps(value)
+
+        assert data[:1] == b"["
+        assert self._makeOne().loads(data) == value
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"\x01",
+            b"\x01\x00" + b"x" * 10,
+            b"\x01\x02",
+            b"\x01\x01\x00\x05abc",
+            b"\x01\x01\x00\x01a\x00\x01b\x00",
+            b"\x02\x01\x00\x01a\x00\x01b",
+            b"\x01\x01\x00\x01\xff\x00\x01b",
+        ],
+    )
+    def test_malformed(self, data):
+        with pytest.raises(ValueError):
+            self._makeOne().loads(data)
+
+    def test_cookie_compact(self):
+        source = sources.CookieAuthSourceInitializer("seekrit", encoding="compact")
+        headers = source(None, DummyRequest()).headers_remember(["user1", self.TICKET])
+        cookie = headers[0][1].split(";")[0].split("=", 1)[1]
+
+        json_source = sources.CookieAuthSourceInitializer("seekrit")
+        json_headers = json_source(None, DummyRequest()).headers_remember(
+            ["user1", self.TICKET]
+        )
+
+        assert len(headers[0][1]) < len(json_headers[0][1])
+
+        request = DummyRequest()
+        request.cookies["auth"] = cookie
+
+        assert source(None, request).get_value() == ["user1", self.TICKET]
+
+    def test_cookie_compact_reads_json(self):
+        json_source = sources.CookieAuthSourceInitializer("seekrit")
+        headers = json_source(None, DummyRequest()).headers_remember(
+            ["user1", "ticket1"]
+        )
+        request = DummyRequest()
+        request.cookies["auth"] = headers[0][1].split(";")[0].split("=", 1)[1]
+        source = sources.CookieAuthSourceInitializer("seekrit", encoding="compact")
+
+        assert source(None, request).get_value() == ["user1", "ticket1"]
+
+    def test_header_compact(self):
+        source = sources.HeaderAuthSourceInitializer("seekrit", encoding="compact")
+        headers = source(None, DummyRequest()).headers_remember(["user1", self.TICKET])
+        (_, token) = headers[0][1].split(" ")
+
+        request = DummyRequest()
+        request.authorization = ("Bearer", token)
+
+        assert source(None, request).get_value() == ["user1", self.TICKET]
+
+    def test_unknown_encoding(self):
+        with pytest.raises(ValueError):
+            sources.HeaderAuthSourceInitializer("seekrit", encoding="xml")
+
+
+class TestCachingSerializer(object):
+    def _makeOne(self):
+        from webob.cookies import SignedSerializer
+
+        from pyramid_authsanity.cache import TTLCache
+
+        return sources.CachingSerializer(
+            SignedSerializer("seekrit", "salt"), TTLCache(max_size=10)
+        )
+
+    def test_loads_cached(self):
+        serializer = self._makeOne()
+        token = serializer.dumps(["user1", "ticket1"])
+
+        assert serializer.loads(token) == ["user1", "ticket1"]
+        assert serializer.loads(token) == ["user1", "ticket1"]
+        assert serializer.cache.hits == 1
+        assert serializer.cache.misses == 1
+
+    def test_loads_returns_copy(self):
+        serializer = self._makeOne()
+        token = serializer.dumps(["user1", "ticket1"])
+
+        serializer.loads(token).append("modified")
+
+        assert serializer.loads(token) == ["user1", "ticket1"]
+
+    def test_loads_not_a_list(self):
+        serializer = self._makeOne()
+        token = serializer.dumps("test")
+
+        assert serializer.loads(token) == "test"
+        assert serializer.loads(token) == "test"
+
+    def test_invalid_not_cached(self):
+        serializer = self._makeOne()
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                serializer.loads(b"invalid")
+
+        assert len(serializer.cache) == 0
+
+    def test_header_source_cache(self):
+        factory = sources.HeaderAuthSourceInitializer("seekrit", cache_size=10)
+        headers = factory(None, DummyRequest()).headers_remember(["user1", "t1"])
+        (_, token) = headers[0][1].split(" ")
+
+        for _ in range(3):
+            request = DummyRequest()
+            request.authorization = ("Bearer", token)
+
+            assert factory(None, request).get_value() == ["user1", "t1"]
+
+        cache = factory.cache
+
+        assert cache is factory(None, DummyRequest()).serializer.cache
+        assert cache.hits == 2
+        assert cache.misses == 1
+
+    def test_cookie_source_cache(self):
+        factory = sources.CookieAuthSourceInitializer("seekrit", cache_size=10)
+        headers = factory(None, DummyRequest()).headers_remember(["user1", "t1"])
+        cookie = headers[0][1].split(";")[0].split("=", 1)[1]
+
+        for _ in range(3):
+            request = DummyRequest()
+            request.cookies["auth"] = cookie
+
+            assert factory(None, request).get_value() == ["user1", "t1"]
+
+        cache = factory.cache
+
+        assert cache is factory(None, DummyRequest()).cookie.serializer.cache
+        assert cache.hits == 2
+
+    def test_no_cache(self):
+        assert sources.CookieAuthSourceInitializer("seekrit").cache is None
+        assert sources.HeaderAuthSourceInitializer("seekrit").cache is None
+
+
+class TestKeyringSerializer(object):
+    def _makeOne(self, keyring, **kw):
+        return sources.KeyringSerializer(keyring, "salt", **kw)
+
+    def test_round_trip(self):
+        serializer = self._makeOne([("k2", "new"), ("k1", "old")])
+        token = serializer.dumps(["user1", "ticket1"])
+
+        assert token.startswith(b"k2.")
+        assert serializer.loads(token) == ["user1", "ticket1"]
+        assert serializer.loads(token.decode("latin-1")) == ["user1", "ticket1"]
+
+    def test_old_key_accepted(self):
+        old = self._makeOne({"k1": "old"})
+        token = old.dumps("test")
+        rotated = self._makeOne({"k2": "new", "k1": "old"})
+
+        assert rotated.loads(token) == "test"
+        assert rotated.dumps("test").startswith(b"k2.")
+
+    def test_removed_key_rejected(self):
+        token = self._makeOne({"k1": "old"}).dumps("test")
+        serializer = self._makeOne({"k2": "new"})
+
+        with pytest.raises(ValueError):
+            serializer.loads(token)
+
+    def test_wrong_key_for_kid(self):
+        token = self._makeOne({"k1": "old"}).dumps("test")
+        serializer = self._makeOne({"k1": "other"})
+
+        with pytest.raises(ValueError):
+            serializer.loads(token)
+
+    def test_legacy_secret(self):
+        from webob.cookies import SignedSerializer
+
+        token = SignedSerializer("seekrit", "salt").dumps("test")
+
+        assert self._makeOne({"k1": "new"}, secret="seekrit").loads(token) == "test"
+
+        with pytest.raises(ValueError):
+            self._makeOne({"k1": "new"}).loads(token)
+
+    def test_hashalg(self):
+        serializer = self._makeOne({"k1": "new"}, hashalg="sha256")
+
+        assert serializer.hashalg == "sha256"
+        assert serializer.loads(serializer.dumps("test")) == "test"
+
+    def test_empty_keyring(self):
+        with pytest.raises(ValueError):
+            self._makeOne([])
+
+    def test_invalid_kid(self):
+        with pytest.raises(ValueError):
+            self._makeOne({"k.1": "secret"})
+
+    def test_duplicate_kid(self):
+        with pytest.raises(ValueError):
+            self._makeOne([("k1", "a"), ("k1", "b")])
+
+
+class TestKeyringSources(object):
+    def test_cookie_rotation(self):
+        old = sources.CookieAuthSourceInitializer(keyring={"k1": "old"})
+        headers = old(None, DummyRequest()).headers_remember(["user1", "ticket1"])
+        cookie = headers[0][1].split(";")[0].split("=", 1)[1]
+
+        new = sources.CookieAuthSourceInitializer(
+            keyring=[("k2", "new"), ("k1", "old")]
+        )
+        request = DummyRequest()
+        request.cookies["auth"] = cookie
+
+        assert new(None, request).get_value() == ["user1", "ticket1"]
+
+    def test_cookie_legacy_secret(self):
+        old = sources.CookieAuthSourceInitializer("seekrit")
+        headers = old(None, DummyRequest()).headers_remember(["user1", "ticket1"])
+        cookie = headers[0][1].split(";")[0].split("=", 1)[1]
+
+        new = sources.CookieAuthSourceInitializer("seekrit", keyring={"k1": "new"})
+        request = DummyRequest()
+        request.cookies["auth"] = cookie
+        source = new(None, request)
+
+        assert source.get_value() == ["user1", "ticket1"]
+        assert "auth=k1." in source.headers_remember(["user1", "ticket1"])[0][1]
+
+    def test_header_rotation(self):
+        old = sources.HeaderAuthSourceInitializer(keyring={"k1": "old"})
+        headers = old(None, DummyRequest()).headers_remember(["user1", "ticket1"])
+        (_, token) = headers[0][1].split(" ")
+
+        assert token.startswith("k1.")
+
+        new = sources.HeaderAuthSourceInitializer(keyring={"k2": "new", "k1": "old"})
+        request = DummyRequest()
+        request.authorization = ("Bearer", token)
+
+        assert new(None, request).get_value() == ["user1", "ticket1"]
+
+    def test_no_secret(self):
+        with pytest.raises(ValueError):
+            sources.HeaderAuthSourceInitializer()
+
+
+class TestCompositeAuthSource(_TestAuthSource):
+    def _makeOne(self, request=None, **kw):
+        obj = sources.CompositeAuthSourceInitializer(
+            [
+                sources.HeaderAuthSourceInitializer("seekrit"),
+                sources.CookieAuthSourceInitializer("seekrit"),
+            ],
+            **kw,
+        )
+
+        if request is None:
+            request = DummyRequest()
+
+        return obj(None, request)
+
+    def _token(self, value):
+        factory = sources.HeaderAuthSourceInitializer("seekrit")
+        headers = factory(None, DummyRequest()).headers_remember(value)
+        return headers[0][1].split(" ")[1]
+
+    def _cookie(self, value):
+        factory = sources.CookieAuthSourceInitializer("seekrit")
+        headers = factory(None, DummyRequest()).headers_remember(value)
+        return headers[0][1].split(";")[0].split("=", 1)[1]
+
+    def test_no_sources(self):
+        with pytest.raises(ValueError):
+            sources.CompositeAuthSourceInitializer([])
+
+    def test_invalid_remember_source(self):
+        with pytest.raises(IndexError):
+            self._makeOne(remember_source=2)
+
+    def test_vary_before_get_value(self):
+        source = self._makeOne()
+
+        assert source.vary == []
+
+    def test_first_source_short_circuits(self):
+        request = DummyRequest()
+        request.authorization = ("Bearer", self._token(["user1", "ticket1"]))
+        request.cookies["auth"] = self._cookie(["user2", "ticket2"])
+        source = self._makeOne(request=request)
+
+        assert source.get_value() == ["user1", "ticket1"]
+        assert source.vary == ["Authorization"]
+
+    def test_falls_through(self):
+        request = DummyRequest()
+        request.cookies["auth"] = self._cookie(["user2", "ticket2"])
+        source = self._makeOne(request=request)
+
+        assert source.get_value() == ["user2", "ticket2"]
+        assert source.get_value() == ["user2", "ticket2"]
+        assert source.vary == ["Authorization", "Cookie"]
+
+    def test_vary_deduplicated(self):
+        obj = sources.CompositeAuthSourceInitializer(
+            [
+                sources.CookieAuthSourceInitializer("seekrit", cookie_name="a"),
+                sources.CookieAuthSourceInitializer("seekrit", cookie_name="b"),
+            ]
+        )
+        source = obj(None, DummyRequest())
+        source.get_value()
+
+        assert source.vary == ["Cookie"]
+
+    def test_remember_active_source(self):
+        request = DummyRequest()
+        request.cookies["auth"] = self._cookie(["user2", "ticket2"])
+        source = self._makeOne(request=request)
+
+        headers = source.headers_remember(["user2", "ticket3"])
+
+        assert headers[0][0] == "Set-Cookie"
+
+    def test_remember_default_source(self):
+        source = self._makeOne(remember_source=-1)
+
+        headers = source.headers_remember(["user1", "ticket1"])
+
+        assert headers[0][0] == "Set-Cookie"
+
+        source = self._makeOne()
+        headers = source.headers_remember(["user1", "ticket1"])
+
+        assert headers[0][0] == "Authorization"
+
+    def test_forget_active_source(self):
+        request = DummyRequest()
+        request.cookies["auth"] = self._cookie(["user2", "ticket2"])
+        source = self._makeOne(request=request)
+
+        headers = source.headers_forget()
+
+        assert headers[0][1].startswith("auth=;")
+
+    def test_forget_nothing(self):
+        source = self._makeOne()
+
+        assert source.headers_forget() == []
+
 
 class DummyRequest(object):
     def __init__(self):
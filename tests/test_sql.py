@@ -0,0 +1,341 @@
+import sqlite3
+import threading
+
+import pytest
+from zope.interface.verify import verifyObject
+
+from pyramid_authsanity import sql
+from pyramid_authsanity.interfaces import IAuthService
+
+SCHEMA = """
+CREATE TABLE authsanity_tickets (
+    ticket VARCHAR(64) PRIMARY KEY,
+    principal VARCHAR(255) NOT NULL,
+    expires DOUBLE PRECISION NULL
+);
+CREATE TABLE authsanity_groups (
+    principal VARCHAR(255) NOT NULL,
+    name VARCHAR(255) NOT NULL
+);
+"""
+
+
+class TestQuery(object):
+    def _makeOne(self, paramstyle):
+        return sql.Query("SELECT {a} WHERE b = {b} OR c = {a}", paramstyle)
+
+    def test_qmark(self):
+        query = self._makeOne("qmark")
+
+        assert query.sql == "SELECT ? WHERE b = ? OR c = ?"
+        assert query.params(a=1, b=2) == (1, 2, 1)
+
+    def test_format(self):
+        query = self._makeOne("format")
+
+        assert query.sql == "SELECT %s WHERE b = %s OR c = %s"
+        assert query.params(a=1, b=2) == (1, 2, 1)
+
+    def test_numeric(self):
+        query = self._makeOne("numeric")
+
+        assert query.sql == "SELECT :1 WHERE b = :2 OR c = :3"
+        assert query.params(a=1, b=2) == (1, 2, 1)
+
+    def test_named(self):
+        query = self._makeOne("named")
+
+        assert query.sql == "SELECT :a WHERE b = :b OR c = :a"
+        assert query.params(a=1, b=2) == {"a": 1, "b": 2}
+
+    def test_pyformat(self):
+        query = self._makeOne("pyformat")
+
+        assert query.sql == "SELECT %(a)s WHERE b = %(b)s OR c = %(a)s"
+        assert query.params(a=1, b=2) == {"a": 1, "b": 2}
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            self._makeOne("unknown")
+
+
+class TestConnectionPool(object):
+    def test_reuses_connection(self):
+        created = []
+
+        def connect():
+            created.append(DummyConnection())
+            return created[-1]
+
+        pool = sql.ConnectionPool(connect, size=1)
+
+        with pool.connection() as conn1:
+            pass
+
+        with pool.connection() as conn2:
+            pass
+
+        assert conn1 is conn2
+        assert len(created) == 1
+
+    def test_closes_extra_connections(self):
+        pool = sql.ConnectionPool(DummyConnection, size=1)
+        conn1 = pool.acquire()
+        conn2 = pool.acquire()
+        pool.release(conn1)
+        pool.release(conn2)
+
+        assert conn1 is not conn2
+        assert not conn1.closed
+        assert conn2.closed
+
+    def test_error_discards_connection(self):
+        pool = sql.ConnectionPool(DummyConnection, size=1)
+
+        with pytest.raises(RuntimeError):
+            with pool.connection() as conn1:
+                raise RuntimeError()
+
+        with pool.connection() as conn2:
+            pass
+
+        assert conn1.closed
+        assert conn1 is not conn2
+
+
+class TestSQLAuthService(object):
+    @pytest.fixture(autouse=True)
+    def database(self, tmp_path):
+        self.path = str(tmp_path / "tickets.db")
+        self.statements = []
+
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO authsanity_groups (principal, name) VALUES (?, ?)",
+            [("bob", "group:staff"), ("bob", "group:admin")],
+        )
+        conn.commit()
+        conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+    def _makeFactory(self, **kw):
+        return sql.SQLAuthServiceInitializer(self.connect, **kw)
+
+    def test_requires_connect(self):
+        with pytest.raises(ValueError):
+            sql.SQLAuthServiceInitializer()
+
+    def test_verify_object(self):
+        assert verifyObject(IAuthService, self._makeFactory()(None, None))
+
+    def test_userid_not_verified(self):
+        svc = self._makeFactory()(None, None)
+
+        with pytest.raises(ValueError):
+            svc.userid()
+
+    def test_verify_no_ticket(self):
+        svc = self._makeFactory()(None, None)
+        svc.verify_ticket(None, None)
+
+        assert svc.userid() is None
+        assert svc.groups() == []
+        assert self.statements == []
+
+    def test_add_verify_ticket(self):
+        factory = self._makeFactory()
+        factory(None, None).add_ticket("bob", "ticket")
+
+        del self.statements[:]
+        svc = factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+        assert sorted(svc.groups()) == ["group:admin", "group:staff"]
+        # The ticket and the groups are fetched using a single query
+        assert len(self.statements) == 1
+
+    def test_verify_no_groups(self):
+        factory = self._makeFactory()
+        factory(None, None).add_ticket("alice", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("alice", "ticket")
+
+        assert svc.userid() == "alice"
+        assert svc.groups() == []
+
+    def test_verify_wrong_principal(self):
+        factory = self._makeFactory()
+        factory(None, None).add_ticket("bob", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("alice", "ticket")
+
+        assert svc.userid() is None
+        assert svc.groups() == []
+
+    def test_expired_ticket(self):
+        factory = self._makeFactory(ttl=-1)
+        factory(None, None).add_ticket("bob", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+    def test_ticket_ttl(self):
+        factory = self._makeFactory(ttl=3600)
+        factory(None, None).add_ticket("bob", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_extend_ticket(self):
+        factory = self._makeFactory(ttl=3600)
+        svc = factory(None, None)
+        svc.add_ticket("bob", "ticket")
+
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("UPDATE authsanity_tickets SET expires = 0")
+
+        svc.extend_ticket("bob", "ticket")
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_extend_ticket_no_ttl(self):
+        factory = self._makeFactory()
+        svc = factory(None, None)
+        svc.add_ticket("bob", "ticket")
+        del self.statements[:]
+
+        svc.extend_ticket("bob", "ticket")
+
+        assert self.statements == []
+
+    def test_remove_ticket(self):
+        factory = self._makeFactory()
+        svc = factory(None, None)
+        svc.add_ticket("bob", "ticket")
+
+        assert svc.remove_ticket("ticket") is True
+        assert svc.remove_ticket("ticket") is False
+
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() is None
+
+    def test_duplicate_ticket(self):
+        factory = self._makeFactory()
+        svc = factory(None, None)
+        svc.add_ticket("bob", "ticket")
+
+        with pytest.raises(sqlite3.IntegrityError):
+            svc.add_ticket("bob", "ticket")
+
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_named_paramstyle(self):
+        factory = self._makeFactory(paramstyle="named")
+        factory(None, None).add_ticket("bob", "ticket")
+
+        svc = factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+
+    def test_read_ends_transaction(self):
+        conn = StubConnection([("bob", "group:staff")])
+        factory = sql.SQLAuthServiceInitializer(pool=sql.ConnectionPool(lambda: conn))
+
+        svc = factory(None, None)
+        svc.verify_ticket("bob", "ticket")
+
+        assert svc.userid() == "bob"
+        assert conn.transactions == ["rollback"]
+
+        svc.add_ticket("bob", "other")
+
+        assert conn.transactions == ["rollback", "commit"]
+
+    def test_shared_pool(self):
+        pool = sql.ConnectionPool(self.connect)
+        factory = sql.SQLAuthServiceInitializer(pool=pool)
+
+        assert factory.pool is pool
+
+    def test_threads(self):
+        factory = self._makeFactory(pool_size=4)
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    ticket = "ticket-%d-%d" % (n, i)
+                    factory(None, None).add_ticket("bob", ticket)
+                    svc = factory(None, None)
+                    svc.verify_ticket("bob", ticket)
+                    assert svc.userid() == "bob"
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        assert errors == []
+
+
+class DummyConnection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubCursor(object):
+    rowcount = 1
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, sql, params):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class StubConnection(DummyConnection):
+    """A connection that opens a transaction for every statement, as drivers
+    without autocommit do."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.transactions = []
+
+    def cursor(self):
+        return StubCursor(self.rows)
+
+    def commit(self):
+        self.transactions.append("commit")
+
+    def rollback(self):
+        self.transactions.append("rollback")
@@ -1,6 +1,38 @@
 from pytest import raises
 
-from pyramid_authsanity.util import add_vary_callback
+from pyramid_authsanity.util import add_vary_callback, keyring_from_settings
+
+
+class TestKeyringFromSettings(object):
+    def test_parse(self):
+        keyring = keyring_from_settings("k2:new\n  k1:old:with:colons")
+
+        assert keyring == [("k2", "new"), ("k1", "old:with:colons")]
+
+    def test_empty(self):
+        assert keyring_from_settings("") == []
+
+    def test_already_parsed(self):
+        assert keyring_from_settings([("k1", "old")]) == [("k1", "old")]
+
+    def test_mapping(self):
+        keyring = keyring_from_settings({"k2": "new-secret", "k1": "old-secret"})
+
+        assert keyring == [("k2", "new-secret"), ("k1", "old-secret")]
+
+    def test_invalid_pairs(self):
+        with raises(ValueError):
+            keyring_from_settings(["k1"])
+
+        with raises(ValueError):
+            keyring_from_settings([("k1", "secret", "extra")])
+
+    def test_invalid(self):
+        with raises(ValueError):
+            keyring_from_settings("k1")
+
+        with raises(ValueError):
+            keyring_from_settings(":secret")
 
 
 class TestAddVaryCallback(object):
@@ -33,6 +65,20 @@ class TestAddVaryCallback(object):
         assert len(response.vary) == 1
         assert "cookie" in response.vary
 
+    def test_add_multiple_existing_other(self):
+        cb = self._makeOne("cookie")
+        response = DummyResponse()
+        response.vary = ("accept",)
+        cb(None, response)
+
+        assert len(response.vary) == 2
+        assert "cookie" in response.vary
+        assert "accept" in response.vary
+
+    def test_callback_shared(self):
+        assert self._makeOne("cookie") is self._makeOne("cookie")
+        assert self._makeOne("cookie") is not self._makeOne("authorization")
+
 
 def test_int_or_none_none():
     from pyramid_authsanity.util import int_or_none
@@ -53,6 +99,18 @@ def test_int_or_none_fail():
         int_or_none("test")
 
 
+def test_float_or_none_none():
+    from pyramid_authsanity.util import float_or_none
+
+    assert float_or_none(None) is None
+
+
+def test_float_or_none_float():
+    from pyramid_authsanity.util import float_or_none
+
+    assert float_or_none("0.5") == 0.5
+
+
 def test_kw_from_settings():
     from pyramid_authsanity.util import kw_from_settings
 
@@ -80,3 +138,18 @@ def test_kw_from_settings_custom():
 
 class DummyResponse(object):
     vary = None
+
+
+def test_request_cache():
+    from pyramid_authsanity.util import _request_cache
+
+    request = DummyRequest()
+    cache = _request_cache(request)
+    cache["test"] = True
+
+    assert _request_cache(request) is cache
+    assert _request_cache(DummyRequest()) == {}
+
+
+class DummyRequest(object):
+    pass